@@ -0,0 +1,94 @@
+import hashlib
+import os
+import queue
+import threading
+
+import numpy as np
+
+
+def _random_state(seed):
+    return seed if isinstance(seed, np.random.RandomState) else np.random.RandomState(seed)
+
+
+def evaluate(poly, x):
+    '''float32 targets of the polynomial for the (N, d) inputs, evaluated in NumPy for the Polynomial specs'''
+    if hasattr(poly, "numpy"):
+        return poly.numpy(x).astype(np.float32)
+    return np.asarray(poly(x), dtype=np.float32)
+
+
+class PolynomialBatches:
+    '''(x, poly(x)) float32 batches of the points drawn uniformly from [0, 1)^d.
+    fixed - the same steps batches in every epoch, the targets are evaluated once (in a single call) and with cache
+    (a directory) they are stored in a file named after the polynomial and the hash of the inputs;
+    otherwise new batches are drawn in every epoch, generated with their targets on a background thread,
+    up to prefetch batches ahead of the training loop.
+    seed may be a RandomState shared by several datasets (drawn in the order of creation)'''
+
+    def __init__(self, poly, steps, batch_size, d=5, seed=None, fixed=True, prefetch=8, cache=None) -> None:
+        super().__init__()
+        self.poly = poly
+        self.steps = steps
+        self.batch_size = batch_size
+        self.d = d
+        self.fixed = fixed
+        self.prefetch = prefetch
+        self.random = _random_state(seed)
+        if fixed:
+            self.x = self.random.rand(steps, batch_size, d).astype(np.float32)
+            self.y = self._fixed_targets(cache)
+
+    def _fixed_targets(self, cache):
+        if cache is None:
+            return evaluate(self.poly, self.x.reshape(-1, self.d)).reshape(self.steps, self.batch_size)
+
+        key = hashlib.sha1(self.x.tobytes()).hexdigest()[:16]
+        path = os.path.join(cache, "%s-%s.npy" % (getattr(self.poly, "__name__", "poly"), key))
+        if os.path.exists(path):
+            return np.load(path)
+        y = evaluate(self.poly, self.x.reshape(-1, self.d)).reshape(self.steps, self.batch_size)
+        os.makedirs(cache, exist_ok=True)
+        tmp = path + ".%d.tmp" % os.getpid()
+        with open(tmp, 'wb') as fh:
+            np.save(fh, y)
+        os.replace(tmp, path)
+        return y
+
+    def __len__(self):
+        return self.steps
+
+    def __iter__(self):
+        if self.fixed:
+            for i in range(self.steps):
+                yield self.x[i], self.y[i]
+            return
+
+        batches = queue.Queue(maxsize=self.prefetch)
+        stop = threading.Event()
+        worker = threading.Thread(target=self._produce, args=(batches, stop), daemon=True)
+        worker.start()
+        try:
+            for _ in range(self.steps):
+                batch = batches.get()
+                if isinstance(batch, Exception):
+                    raise batch
+                yield batch
+        finally:
+            stop.set()
+            worker.join()
+
+    def _produce(self, batches, stop):
+        for _ in range(self.steps):
+            try:
+                x = self.random.rand(self.batch_size, self.d).astype(np.float32)
+                batch = x, evaluate(self.poly, x)
+            except Exception as e:
+                batch = e
+            while not stop.is_set():
+                try:
+                    batches.put(batch, timeout=0.1)
+                    break
+                except queue.Full:
+                    pass
+            if stop.is_set() or isinstance(batch, Exception):
+                return
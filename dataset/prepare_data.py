@@ -1,96 +1,157 @@
+import os
+from argparse import ArgumentParser
 from math import pi
-from random import *
+from multiprocessing import Pool
+
 import numpy as np
 import cv2
-import matplotlib.pyplot as plt
-import tensorflow as tf
-
-tf.enable_eager_execution()
-
-
-def area(path, roll, id=0):
-    def area(xy):
-        def cross_product3(a, b):
-            return a[:, :, 0] * b[:, :, 1] - b[:, :, 0] * a[:, :, 1]
-
-        def if_collide(verts, query_points):
-            first_point_coords = verts
-            second_point_coords = tf.roll(verts, -1, -2)
-            edge_vector = second_point_coords - first_point_coords
-            query_points_in_v1 = query_points[:, tf.newaxis] - first_point_coords[tf.newaxis]
-            cross = cross_product3(edge_vector[tf.newaxis], query_points_in_v1)
-            inside = tf.logical_or(tf.reduce_all(cross > 0, -1), tf.reduce_all(cross < 0, -1))
-            return inside
-
-        n = int(1e5)
-        a = 2.
-        pts = 2 * a * np.random.rand(n, 2) - a
-        collide = if_collide(xy, pts)
-        s = np.sum((tf.cast(collide, tf.float32)).numpy())
-        return s / n * (2 * a) ** 2
-
-    convex = False
-    while not convex:
-        d = 0.2
-        xc = (1. - d * 2) * random() + d
-        yc = (1. - d * 2) * random() + d
-        # base = np.array([0., pi/2, pi, 3*pi/2])
-        # n = 3
-        n = 4
-        b = 2 / n * pi
-        base = np.arange(n) * b
-        if roll:
-            base = np.roll(base, randint(0, n - 1))
-        th = b * np.random.random(n) + base
-        rb = 0.3 + 0.5 * random()
-        r = 0.4 * (np.random.random(n) - 0.5) + rb
-        xq = r * np.cos(th) + xc
-        yq = r * np.sin(th) + yc
-
-        xq = np.abs(xq)
-        yq = np.abs(yq)
-        plt.plot(np.concatenate([xq, xq[:1]], -1), np.concatenate([yq, yq[:1]], -1))
-
-        xy = np.stack([xq, yq], axis=-1)
-        a = area(xy)
-
-        W = 64
-        H = 64
-        W_range = 1.5
-        H_range = 1.5
-
-        diffx = np.diff(np.concatenate([xq, xq[:1]], axis=0))
-        diffy = np.diff(np.concatenate([yq, yq[:1]], axis=0))
-
-        diffx_1 = np.roll(diffx, 1, 0)
-        diffy_1 = np.roll(diffy, 1, 0)
-
-        cross = diffx * diffy_1 - diffx_1 * diffy
-        convex = np.logical_or(np.all(cross > 0), np.all(cross < 0))
-
-    xq_px = np.around(W * xq / W_range)
-    yq_px = np.around(H * ((H_range - yq) / H_range))
+
+
+def sample_polygons(rng, count, n=4, roll=False):
+    '''(count, n, 2) random polygons with vertices around a random center, not necessarily convex'''
+    d = 0.2
+    c = (1. - d * 2) * rng.rand(count, 2) + d
+    b = 2 / n * pi
+    base = np.tile(np.arange(n) * b, (count, 1))
+    if roll:
+        shift = rng.randint(0, n, count)
+        base = base[np.arange(count)[:, np.newaxis], (np.arange(n)[np.newaxis] - shift[:, np.newaxis]) % n]
+    th = b * rng.rand(count, n) + base
+    rb = 0.3 + 0.5 * rng.rand(count, 1)
+    r = 0.4 * (rng.rand(count, n) - 0.5) + rb
+    xq = np.abs(r * np.cos(th) + c[:, :1])
+    yq = np.abs(r * np.sin(th) + c[:, 1:])
+    return np.stack([xq, yq], axis=-1)
+
+
+def is_convex(xy):
+    diff = np.roll(xy, -1, axis=1) - xy
+    diff_1 = np.roll(diff, 1, axis=1)
+    cross = diff[..., 0] * diff_1[..., 1] - diff_1[..., 0] * diff[..., 1]
+    return np.logical_or(np.all(cross > 0, axis=1), np.all(cross < 0, axis=1))
+
+
+def shoelace_area(xy):
+    x = xy[..., 0]
+    y = xy[..., 1]
+    return 0.5 * np.abs(np.sum(x * np.roll(y, -1, axis=1) - np.roll(x, -1, axis=1) * y, axis=1))
+
+
+def mc_area(xy, rng, samples=int(1e5)):
+    '''Monte Carlo estimate of the convex polygons area (the original, noisy, way of labeling the data)'''
+    a = 2.
+    areas = []
+    for verts in xy:
+        pts = 2 * a * rng.rand(samples, 2) - a
+        edge = np.roll(verts, -1, axis=0) - verts
+        rel = pts[:, np.newaxis] - verts[np.newaxis]
+        cross = edge[np.newaxis, :, 0] * rel[..., 1] - rel[..., 0] * edge[np.newaxis, :, 1]
+        inside = np.logical_or(np.all(cross > 0, -1), np.all(cross < 0, -1))
+        areas.append(np.mean(inside) * (2 * a) ** 2)
+    return np.array(areas)
+
+
+def convex_polygons(rng, count, n=4, roll=False):
+    '''draws candidates in batches and keeps the convex ones until count polygons are collected'''
+    polygons = []
+    left = count
+    while left > 0:
+        candidates = sample_polygons(rng, 2 * left + 16, n, roll)
+        candidates = candidates[is_convex(candidates)][:left]
+        polygons.append(candidates)
+        left -= len(candidates)
+    return np.concatenate(polygons, axis=0)
+
+
+def polygon_mask(xy, W=64, H=64, W_range=1.5, H_range=1.5):
+    xq_px = np.around(W * xy[:, 0] / W_range)
+    yq_px = np.around(H * ((H_range - xy[:, 1]) / H_range))
 
     poly = np.stack([xq_px, yq_px], -1).astype(np.int32)
 
     m = np.zeros((W, H), dtype=np.uint8)
-    cv2.fillPoly(m, [poly.astype(np.int32)], 255)
-
-    scenario = np.concatenate([xq, yq, [a]], -1)
-
-    fname = path + str(id).zfill(6)
-    np.savetxt(fname + ".scn", scenario, fmt='%.4f', delimiter='\t')
-    # plt.savefig(fname + ".png")
-    # plt.clf()
-    cv2.imwrite(fname + ".png", m)
-
-
-path = "../../data_inv/train/area4paper_shift/"
-for i in range(256):
-    area(path, False, i)
-path = "../../data_inv/val/area4paper_shift/"
-for i in range(256):
-    area(path, True, i)
-path = "../../data_inv/test/area4paper_shift/"
-for i in range(1024):
-    area(path, True, i)
+    cv2.fillPoly(m, [poly], 255)
+    return m
+
+
+def generate(rng, count, n=4, roll=False, area="exact", mc_samples=int(1e5)):
+    xy = convex_polygons(rng, count, n, roll)
+    if area == "exact":
+        a = shoelace_area(xy)
+    elif area == "mc":
+        a = mc_area(xy, rng, mc_samples)
+    else:
+        raise ValueError("Unknown area mode: %s" % area)
+    return xy, a
+
+
+def write_scenarios(path, xy, a, start=0, masks=True):
+    os.makedirs(path, exist_ok=True)
+    for i in range(len(xy)):
+        scenario = np.concatenate([xy[i, :, 0], xy[i, :, 1], [a[i]]], -1)
+        fname = os.path.join(path, str(start + i).zfill(6))
+        np.savetxt(fname + ".scn", scenario, fmt='%.4f', delimiter='\t')
+        if masks:
+            cv2.imwrite(fname + ".png", polygon_mask(xy[i]))
+
+
+def write_shard(path, shard, xy, a, masks=True):
+    '''shard-<id>.npy with the (N, 2 * n + 1) float32 rows like in the .scn files,
+    shard-<id>.masks.npy with the (N, H, W / 8) masks packed along the rows'''
+    fname = os.path.join(path, "shard-%05d" % shard)
+    scenarios = np.concatenate([xy[..., 0], xy[..., 1], a[:, np.newaxis]], -1).astype(np.float32)
+    np.save(fname + ".npy", scenarios)
+    if masks:
+        m = np.stack([polygon_mask(p) for p in xy], axis=0)
+        np.save(fname + ".masks.npy", np.packbits(m > 0, axis=-1))
+
+
+def _generate_shard(job):
+    path, shard, count, seed, n, roll, area, mc_samples, masks = job
+    # every shard has its own stream, so the result does not depend on the number of workers
+    rng = np.random.RandomState(None if seed is None else [seed, shard])
+    xy, a = generate(rng, count, n, roll, area, mc_samples)
+    write_shard(path, shard, xy, a, masks)
+    return count
+
+
+def generate_sharded(path, count, shard_size, n=4, roll=False, area="exact", mc_samples=int(1e5), masks=True,
+                     seed=None, workers=None):
+    os.makedirs(path, exist_ok=True)
+    jobs = [(path, k, min(shard_size, count - start), seed, n, roll, area, mc_samples, masks)
+            for k, start in enumerate(range(0, count, shard_size))]
+    with Pool(workers) as pool:
+        return sum(pool.imap_unordered(_generate_shard, jobs))
+
+
+def main(args):
+    rng = np.random.RandomState(args.seed)
+    # the training set contains only the polygons with the first vertex in the first quarter
+    for k, (split, size, roll) in enumerate([("train", args.train_size, False), ("val", args.val_size, True),
+                                             ("test", args.test_size, True)]):
+        path = os.path.join(args.path, split, args.name)
+        if args.shard_size > 0:
+            seed = None if args.seed is None else args.seed + k
+            generate_sharded(path, size, args.shard_size, args.vertices, roll, args.area, args.mc_samples,
+                             not args.no_masks, seed, args.workers)
+        else:
+            xy, a = generate(rng, size, args.vertices, roll, args.area, args.mc_samples)
+            write_scenarios(path, xy, a, masks=not args.no_masks)
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('--path', type=str, default="../../data_inv")
+    parser.add_argument('--name', type=str, default="area4paper_shift")
+    parser.add_argument('--train-size', type=int, default=256)
+    parser.add_argument('--val-size', type=int, default=256)
+    parser.add_argument('--test-size', type=int, default=1024)
+    parser.add_argument('--vertices', type=int, default=4)
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--area', type=str, default="exact", choices=["exact", "mc"])
+    parser.add_argument('--mc-samples', type=int, default=int(1e5))
+    parser.add_argument('--shard-size', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--no-masks', action='store_true')
+    args = parser.parse_args()
+    main(args)
@@ -1,27 +1,138 @@
+import hashlib
+import json
 import os
+from argparse import ArgumentParser
+
 import numpy as np
 import tensorflow as tf
 
 tf.enable_eager_execution()
 
+CACHE_VERSION = 1
+
+
+def _shard_files(path):
+    return sorted(f for f in os.listdir(path) if f.startswith("shard-") and f.endswith(".npy")
+                  and not f.endswith(".masks.npy"))
+
+
+def _scn_files(path):
+    return sorted(f for f in os.listdir(path) if f.endswith(".scn"))
+
+
+def _cache_paths(path):
+    base = os.path.normpath(path)
+    return base + ".npy", base + ".json"
+
+
+def _signature(path, files):
+    '''hash of the names, sizes and modification times of the .scn files, cheap to recompute at every start'''
+    h = hashlib.sha1()
+    for f in files:
+        st = os.stat(os.path.join(path, f))
+        h.update(("%s\t%d\t%d\n" % (f, st.st_size, st.st_mtime_ns)).encode())
+    return h.hexdigest()
+
+
+def _parse(path, files):
+    data = [np.loadtxt(os.path.join(path, f), delimiter='\t', dtype=np.float32) for f in files]
+    return np.stack(data, 0) if data else np.zeros((0, 9), dtype=np.float32)
+
+
+def build_cache(path):
+    '''parses all the .scn files in path into a single (N, 2 * n + 1) float32 array,
+    stored in <path>.npy along with the <path>.json index (file names and signature)'''
+    files = _scn_files(path)
+    data = _parse(path, files)
+
+    data_path, index_path = _cache_paths(path)
+    index = {"version": CACHE_VERSION, "count": len(files), "shape": list(data.shape),
+             "hash": _signature(path, files), "files": files}
+    # write to temporary files first, several training scripts may start at the same time
+    tmp = ".%d.tmp" % os.getpid()
+    with open(data_path + tmp, 'wb') as fh:
+        np.save(fh, data)
+    os.replace(data_path + tmp, data_path)
+    with open(index_path + tmp, 'w') as fh:
+        json.dump(index, fh)
+    os.replace(index_path + tmp, index_path)
+    return data
+
+
+def load_scenarios(path, cache=True):
+    '''(N, 2 * n + 1) array of [x_1..x_n, y_1..y_n, area] rows for the .scn files in path (sorted by name),
+    or for the shard-*.npy files written by prepare_data.py --shard-size'''
+    shards = _shard_files(path)
+    if shards:
+        return np.concatenate([np.load(os.path.join(path, f), mmap_mode='r') for f in shards], 0)
+
+    if not cache:
+        return _parse(path, _scn_files(path))
+
+    data_path, index_path = _cache_paths(path)
+    if os.path.exists(data_path) and os.path.exists(index_path):
+        with open(index_path, 'r') as fh:
+            index = json.load(fh)
+        if index["version"] == CACHE_VERSION and index["hash"] == _signature(path, _scn_files(path)):
+            return np.load(data_path, mmap_mode='r')
+    return build_cache(path)
+
+
+def load_masks(path):
+    '''(N, H, W) uint8 masks (0 / 255) stored in the shard-*.masks.npy files, in the order of load_scenarios'''
+    shards = [f.replace(".npy", ".masks.npy") for f in _shard_files(path)]
+    masks = np.concatenate([np.load(os.path.join(path, f)) for f in shards], 0)
+    return np.unpackbits(masks, axis=-1).astype(np.uint8) * 255
+
+
+def split_scenarios(data):
+    n = (data.shape[1] - 1) // 2
+    xy = np.stack([data[:, :n], data[:, n:2 * n]], -1)
+    area = np.array(data[:, 2 * n])
+    return xy, area
+
+
+def quadrangle_area_dataset(path, batch_size=None, shuffle=True, seed=None, cache=True):
+    '''dataset of (xy, area) built from the preloaded arrays; if batch_size is given it is already shuffled
+    (anew at every iteration), batched and prefetched, so it can be iterated directly in every epoch'''
+    xy, area = split_scenarios(load_scenarios(path, cache))
+    size = len(area)
+
+    ds = tf.data.Dataset.from_tensor_slices((xy, area))
+    if shuffle:
+        ds = ds.shuffle(buffer_size=size, seed=seed, reshuffle_each_iteration=True)
+    if batch_size is not None:
+        ds = ds.batch(batch_size).prefetch(tf.data.experimental.AUTOTUNE)
+
+    return ds, size
+
+
+class QuadrangleBatches:
+    '''whole (xy, area) batches sliced directly from the preloaded arrays, without tf.data'''
 
-def quadrangle_area_dataset(path):
-    def read_scn(scn_path):
-        scn_path = os.path.join(path, scn_path)
-        data = np.loadtxt(scn_path, delimiter='\t', dtype=np.float32)
-        x = data[:4]
-        y = data[4:8]
-        xy = tf.stack([x, y], -1)
-        area = data[8]
-        return xy, area
+    def __init__(self, path, batch_size, shuffle=True, seed=None, cache=True) -> None:
+        super().__init__()
+        xy, area = split_scenarios(load_scenarios(path, cache))
+        self.xy = tf.constant(xy)
+        self.area = tf.constant(area)
+        self.size = len(area)
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.random = np.random.RandomState(seed)
 
-    scenarios = [read_scn(f) for f in sorted(os.listdir(path)) if f.endswith(".scn")]
+    def __len__(self):
+        return (self.size + self.batch_size - 1) // self.batch_size
 
-    def gen():
-        for i in range(len(scenarios)):
-            yield scenarios[i][0], scenarios[i][1]
+    def __iter__(self):
+        idx = self.random.permutation(self.size) if self.shuffle else np.arange(self.size)
+        for i in range(0, self.size, self.batch_size):
+            batch = idx[i:i + self.batch_size]
+            yield tf.gather(self.xy, batch), tf.gather(self.area, batch)
 
-    ds = tf.data.Dataset.from_generator(gen, (tf.float32, tf.float32)) \
-        .shuffle(buffer_size=len(scenarios), reshuffle_each_iteration=True)
 
-    return ds, len(scenarios)
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('paths', type=str, nargs='+')
+    args = parser.parse_args()
+    for p in args.paths:
+        print(p, build_cache(p).shape)
@@ -0,0 +1,166 @@
+import inspect
+import json
+import os
+import subprocess
+import sys
+from argparse import ArgumentParser
+from time import perf_counter
+
+import numpy as np
+
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0, parentdir)
+
+# add parent (root) to pythonpath
+import models.area as area
+import models.poly as poly
+from models.ginv import sigmaPi, sigmaPiReduce, prepare_permutation_matices, prepare_permutation_indices
+from utils.execution import set_cpu_threads, parse_cpus, model_output
+from utils.permutation_groups import group as permutation_group
+
+import tensorflow as tf
+
+tf.enable_eager_execution()
+
+KERNELS = ["sigmaPi", "sigmaPiGather", "sigmaPiStream", "sigmaPiLog"]
+MODELS = ["GroupInvariance", "GroupInvarianceConv", "SimpleNet", "Conv1d", "Maron"]
+# the models which do not depend on the number of features
+G_AVG = ["SimpleNet", "Conv1d", "Maron"]
+
+
+def _kernel(target, perm, num_features):
+    m, n = len(perm), len(perm[0])
+    if target == "sigmaPi":
+        p = prepare_permutation_matices(perm, n, m)
+        return lambda x: sigmaPi(x, m, n, p)
+    idx = prepare_permutation_indices(perm, n, m)
+    reduction = {"sigmaPiGather": "prod", "sigmaPiStream": "stream", "sigmaPiLog": "log"}[target]
+    return lambda x: sigmaPiReduce(x, idx, reduction)
+
+
+def _model(target, perm, num_features):
+    '''the 4-point groups act on the quadrangles (area models), the 5-point ones on the polynomial inputs'''
+    family = area if len(perm[0]) == 4 else poly
+    if target in ["GroupInvariance", "GroupInvarianceConv"]:
+        model = getattr(family, target)(perm, num_features)
+    else:
+        model = getattr(family, target)(perm=perm)
+    return lambda x: model_output(model(x))[0]
+
+
+def _input(target, perm, num_features, batch_size, rng):
+    n = len(perm[0])
+    if target in KERNELS:
+        shape = (batch_size, n, num_features, n)
+    elif n == 4:
+        shape = (batch_size, n, 2)
+    else:
+        shape = (batch_size, n)
+    return tf.constant(rng.rand(*shape).astype(np.float32))
+
+
+def time_calls(fn, x, warmup=5, repeats=20):
+    '''latencies of repeated fn(x) calls (with the results copied to the host), after the warmup calls'''
+    for _ in range(warmup):
+        np.asarray(fn(x))
+    times = []
+    for _ in range(repeats):
+        start = perf_counter()
+        np.asarray(fn(x))
+        times.append(perf_counter() - start)
+    return np.array(times)
+
+
+def configurations(args):
+    for group in args.groups:
+        for target in args.targets:
+            for num_features in [None] if target in G_AVG else args.features:
+                for batch_size in args.batch_sizes:
+                    yield group, target, num_features, batch_size
+
+
+def run(args):
+    rng = np.random.RandomState(args.seed)
+    results = []
+    for group, target, num_features, batch_size in configurations(args):
+        perm = permutation_group(group)
+        build = _kernel if target in KERNELS else _model
+        fn = build(target, perm, num_features)
+        x = _input(target, perm, num_features or 1, batch_size, rng)
+        times = time_calls(fn, x, args.warmup, args.repeats)
+        r = {
+            "target": target,
+            "group": group,
+            "order": len(perm),
+            "degree": len(perm[0]),
+            "num_features": num_features,
+            "batch_size": batch_size,
+            "mean": float(np.mean(times)),
+            "std": float(np.std(times)),
+            "min": float(np.min(times)),
+            "p50": float(np.percentile(times, 50)),
+            "p90": float(np.percentile(times, 90)),
+            "throughput": batch_size / float(np.median(times)),
+        }
+        print("%-20s %-3s n=%-4s b=%-5d p50 %.6f p90 %.6f | %.1f samples/sec" % (
+            target, group, num_features, batch_size, r["p50"], r["p90"], r["throughput"]))
+        results.append(r)
+    return results
+
+
+def _key(r):
+    return r["target"], r["group"], r["num_features"], r["batch_size"]
+
+
+def compare(results, baseline_path, threshold):
+    '''prints the p50 ratios against a previous run, the ones slower by more than threshold are marked'''
+    with open(baseline_path, 'r') as fh:
+        baseline = {_key(r): r for r in json.load(fh)["results"]}
+    for r in results:
+        b = baseline.get(_key(r))
+        if b is None:
+            continue
+        ratio = r["p50"] / b["p50"]
+        print("%-20s %-3s n=%-4s b=%-5d %.3fx%s" % (_key(r) + (ratio, " REGRESSION" if ratio > 1 + threshold else "")))
+
+
+def write(path, args, results):
+    if path.endswith(".csv"):
+        keys = list(results[0].keys())
+        with open(path, 'w') as fh:
+            fh.write("\t".join(keys) + "\n")
+            for r in results:
+                fh.write("\t".join(str(r[k]) for k in keys) + "\n")
+        return
+    try:
+        commit = subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=parentdir).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    with open(path, 'w') as fh:
+        json.dump({"commit": commit, "threads": args.threads, "cpus": args.cpus, "results": results}, fh,
+                  indent=1, sort_keys=True)
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('--groups', type=str, nargs='+', default=["Z4", "Z5", "D8", "A4", "S4", "S3"])
+    parser.add_argument('--targets', type=str, nargs='+', default=KERNELS + MODELS, choices=KERNELS + MODELS)
+    parser.add_argument('--features', type=int, nargs='+', default=[1, 8, 32])
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 32, 256])
+    parser.add_argument('--warmup', type=int, default=5)
+    parser.add_argument('--repeats', type=int, default=20)
+    parser.add_argument('--threads', type=int, default=None)
+    parser.add_argument('--cpus', type=str, default=None)
+    parser.add_argument('--seed', type=int, default=444)
+    parser.add_argument('--output', type=str, default=None)
+    parser.add_argument('--compare', type=str, default=None)
+    parser.add_argument('--threshold', type=float, default=0.1)
+    args = parser.parse_args()
+
+    set_cpu_threads(args.threads, parse_cpus(args.cpus) if args.cpus else None)
+    results = run(args)
+    if args.compare is not None:
+        compare(results, args.compare, args.threshold)
+    if args.output is not None:
+        write(args.output, args, results)
@@ -1,6 +1,8 @@
 import inspect
 import os
 import sys
+from time import time
+
 import numpy as np
 
 from utils.permutation_groups import Z4
@@ -19,7 +21,9 @@ import tensorflow as tf
 import tensorflow.contrib as tfc
 from tqdm import tqdm
 
-from utils.execution import ExperimentHandler, LoadFromFile
+from utils.execution import ExperimentHandler, LoadFromFile, set_cpu_threads, make_train_step, make_eval_step
+from utils import planner
+from utils.replicas import StackedBatches, build_replicas, train_replicas
 
 tf.enable_eager_execution()
 # tf.set_random_seed(444)
@@ -38,130 +42,133 @@ def _ds(title, ds, ds_size, i, batch_size):
 
 
 def main(args):
-    # 1. Get datasets
-    train_ds, train_size = scenarios.quadrangle_area_dataset(args.scenario_path)
-    val_ds, val_size = scenarios.quadrangle_area_dataset(args.scenario_path.replace("train", "val"))
+    set_cpu_threads(args.threads)
+    if args.seed is not None:
+        tf.set_random_seed(args.seed)
 
+    # 1. Get datasets
+    train_ds, train_size = scenarios.quadrangle_area_dataset(args.scenario_path, args.batch_size, seed=args.seed)
     val_bs = args.batch_size
-    val_ds = val_ds \
-        .batch(val_bs) \
-        .prefetch(val_bs)
+    val_ds, val_size = scenarios.quadrangle_area_dataset(args.scenario_path.replace("train", "val"), val_bs,
+                                                         shuffle=False)
 
     # 2. Define model
 
-    model = None
-    if args.model == "FC_G-inv":
-        model = GroupInvariance(Z4, args.n)
-    elif args.model == "Conv1D_G-inv":
-        model = GroupInvarianceConv(Z4, args.n)
-    elif args.model == "FC_G-avg":
-        model = SimpleNet()
-    elif args.model == "Conv1D_G-avg":
-        model = Conv1d()
-    elif args.model == "Maron":
-        model = Maron()
-    else:
+    if args.model == "auto":
+        args.model = planner.choose("area", Z4, args.batch_size, args.n, planner.memory_cap_bytes(args),
+                                    args.calibrate)
+        print("model:", args.model)
+
+    def model_fn():
+        if args.model == "FC_G-inv":
+            return GroupInvariance(Z4, args.n)
+        elif args.model == "Conv1D_G-inv":
+            return GroupInvarianceConv(Z4, args.n)
+        elif args.model == "FC_G-avg":
+            return SimpleNet()
+        elif args.model == "Conv1D_G-avg":
+            return Conv1d()
+        elif args.model == "Maron":
+            return Maron()
         print("NO MODEL NAME PROVIDED!!!")
 
     # 3. Optimization
     optimizer = tf.train.AdamOptimizer(args.eta)
-    l2_reg = tf.keras.regularizers.l2(1e-5)
+
+    def loss_fn(area, pred):
+        return tf.keras.losses.mean_absolute_error(area[:, tf.newaxis], pred),
+
+    if args.replicas > 1:
+        # every replica is trained on its own shuffling of the training set
+        seeds = [None if args.seed is None else args.seed + k for k in range(1, args.replicas)]
+        train_ds = StackedBatches([train_ds] + [
+            scenarios.quadrangle_area_dataset(args.scenario_path, args.batch_size, seed=s)[0] for s in seeds])
+        ensemble, members = build_replicas(model_fn, args.replicas, np.zeros((1, 4, 2), np.float32))
+        train_replicas(args, members, ensemble, optimizer, loss_fn, train_ds, val_ds)
+        return
+
+    model = model_fn()
+    train_step_fn = make_train_step(model, optimizer, loss_fn, args.compile)
+    val_step_fn = make_eval_step(model, loss_fn, args.compile)
 
     # 4. Restore, Log & Save
-    experiment_handler = ExperimentHandler(args.working_path, args.out_name, args.log_interval, model, optimizer)
+    experiment_handler = ExperimentHandler(args.working_path, args.out_name, args.log_interval, model, optimizer,
+                                           args.keep_last, patience=args.patience, min_delta=args.min_delta)
+    start_epoch, train_step, val_step = 0, 0, 0
+    state = experiment_handler.restore_last() if args.resume else None
+    if state is not None:
+        start_epoch, train_step, val_step = state["epoch"] + 1, state["train_step"], state["val_step"]
+        tqdm.write("Resumed from the epoch %d" % state["epoch"])
 
     # 5. Run everything
-    train_step, val_step = 0, 0
-    best_accuracy = 1e10
-    for epoch in range(args.num_epochs):
-        # workaround for tf problems with shuffling
-        dataset_epoch = train_ds.shuffle(train_size)
-        dataset_epoch = dataset_epoch.batch(args.batch_size).prefetch(args.batch_size)
-
+    # per-sample metrics accumulated on the device, read back at the end of the epoch
+    loss_metric = tf.keras.metrics.Mean()
+    for epoch in range(start_epoch, args.num_epochs):
         # 5.1. Training Loop
         experiment_handler.log_training()
-        acc = []
-        for i, quad, area, in _ds('Train', dataset_epoch, train_size, epoch, args.batch_size):
-            # 5.1.1. Make inference of the model, calculate losses and record gradients
-            with tf.GradientTape(persistent=True) as tape:
-                L = 0.0
-                pred = model(quad)
-                if len(pred) == 2:
-                    pred, L = pred
-
-                ## uncomment to check model size
-                # nw = 0
-                # for layer in model.layers:
-                #    for l in layer.get_weights():
-                #        a = 1
-                #        for s in l.shape:
-                #            a *= s
-                #        nw += a
-                # print(nw)
-
-                model_loss = tf.keras.losses.mean_absolute_error(area[:, tf.newaxis], pred)
-                reg_loss = tfc.layers.apply_regularization(l2_reg, model.trainable_variables)
-
-                total_loss = model_loss + L
-
-            # 5.1.2 Take gradients (if necessary apply regularization like clipping),
-            grads = tape.gradient(total_loss, model.trainable_variables)
-
-            optimizer.apply_gradients(zip(grads, model.trainable_variables),
-                                      global_step=tf.train.get_or_create_global_step())
-
-            acc = acc + list(model_loss.numpy())
+        loss_metric.reset_states()
+        start = time()
+        for i, quad, area, in _ds('Train', train_ds, train_size, epoch, args.batch_size):
+            # 5.1.1. Make inference of the model, calculate losses and apply gradients
+            model_loss, = train_step_fn(quad, area)
+
+            loss_metric.update_state(model_loss)
 
             # 5.1.4 Save logs for particular interval
-            with tfc.summary.record_summaries_every_n_global_steps(args.log_interval, train_step):
-                tfc.summary.scalar('metrics/model_loss', model_loss, step=train_step)
+            if train_step % args.log_interval == 0:
+                with tfc.summary.always_record_summaries():
+                    tfc.summary.scalar('metrics/model_loss', model_loss, step=train_step)
 
             # 5.1.5 Update meta variables
             train_step += 1
+        steps_per_sec = (i + 1) / (time() - start)
+        tqdm.write("Train epoch %d | %.2f steps/sec" % (epoch, steps_per_sec))
 
         # 5.1.6 Take statistics over epoch
+        train_accuracy = loss_metric.result().numpy()
         with tfc.summary.always_record_summaries():
-            tfc.summary.scalar('epoch/accuracy', np.mean(acc), step=epoch)
+            tfc.summary.scalar('epoch/accuracy', train_accuracy, step=epoch)
+            tfc.summary.scalar('epoch/steps_per_sec', steps_per_sec, step=epoch)
 
-        with open(args.working_path + "/" + args.out_name + "/" + model.name + ".csv", 'a') as fh:
-            fh.write("TRAIN, %d, %.6f\n" % (epoch, np.mean(acc)))
+        experiment_handler.write_csv("TRAIN, %d, %.6f\n" % (epoch, train_accuracy))
 
         # 5.2. Validation Loop
         accuracy = tfc.eager.metrics.Accuracy('metrics/accuracy')
         experiment_handler.log_validation()
-        acc = []
+        loss_metric.reset_states()
         for i, quad, area in _ds('Validation', val_ds, val_size, epoch, val_bs):
             # 5.2.1 Make inference of the model for validation and calculate losses
-            L = 0.0
-            pred = model(quad)
-            if len(pred) == 2:
-                pred, L = pred
+            model_loss, = val_step_fn(quad, area)
 
-            model_loss = tf.keras.losses.mean_absolute_error(area[:, tf.newaxis], pred)
-
-            acc = acc + list(model_loss.numpy())
+            loss_metric.update_state(model_loss)
 
             # 5.2.3 Print logs for particular interval
-            with tfc.summary.record_summaries_every_n_global_steps(args.log_interval, val_step):
-                tfc.summary.scalar('metrics/model_loss', model_loss, step=val_step)
+            if val_step % args.log_interval == 0:
+                with tfc.summary.always_record_summaries():
+                    tfc.summary.scalar('metrics/model_loss', model_loss, step=val_step)
 
             val_step += 1
 
-        epoch_accuracy = np.mean(acc)
+        epoch_accuracy = loss_metric.result().numpy()
         # 5.2.5 Take statistics over epoch
         with tfc.summary.always_record_summaries():
             tfc.summary.scalar('epoch/accuracy', epoch_accuracy, step=epoch)
 
-        with open(args.working_path + "/" + args.out_name + "/" + model.name + ".csv", 'a') as fh:
-            fh.write("VAL, %d, %.6f\n" % (epoch, epoch_accuracy))
+        experiment_handler.write_csv("VAL, %d, %.6f\n" % (epoch, epoch_accuracy))
 
         # 5.3 Save last and best
-        if epoch_accuracy < best_accuracy:
-            model.save_weights(args.working_path + "/" + args.out_name + "/checkpoints/best-" + str(epoch))
-            best_accuracy = epoch_accuracy
-        model.save_weights(args.working_path + "/" + args.out_name + "/checkpoints/last_n-" + str(epoch))
+        stop = experiment_handler.update_best(epoch_accuracy, epoch)
+        if args.checkpoint_interval and (stop or (epoch + 1) % args.checkpoint_interval == 0 or
+                                         epoch == args.num_epochs - 1):
+            experiment_handler.save_state(epoch, train_step, val_step)
 
         experiment_handler.flush()
+        if stop:
+            experiment_handler.mark_stopped(epoch)
+            tqdm.write("Early stopping at epoch %d, the best epoch is %d" % (epoch, experiment_handler.best_epoch))
+            break
+
+    experiment_handler.close()
 
 
 if __name__ == '__main__':
@@ -176,5 +183,15 @@ if __name__ == '__main__':
     parser.add_argument('--out-name', type=str)
     parser.add_argument('--eta', type=float, default=5e-4)
     parser.add_argument('--n', type=int, default=2)
+    parser.add_argument('--compile', action='store_true')
+    parser.add_argument('--seed', type=int, default=None)
+    planner.add_planner_args(parser)
+    parser.add_argument('--keep-last', type=int, default=3)
+    parser.add_argument('--patience', type=int, default=None)
+    parser.add_argument('--min-delta', type=float, default=0.)
+    parser.add_argument('--resume', action='store_true')
+    parser.add_argument('--checkpoint-interval', type=int, default=10)
+    parser.add_argument('--threads', type=int, default=None)
+    parser.add_argument('--replicas', type=int, default=1)
     args, _ = parser.parse_known_args()
     main(args)
@@ -1,8 +1,7 @@
 import inspect
 import os
 import sys
-from glob import glob
-from time import time
+from argparse import ArgumentParser
 
 import numpy as np
 
@@ -14,23 +13,23 @@ sys.path.insert(0, parentdir)
 
 # add parent (root) to pythonpath
 from models.poly import GroupInvariance
+from utils.evaluation import best_checkpoint, evaluate_model, write_results, add_evaluation_args
 from utils.permutation_groups import *
 from utils.polynomials import *
 
 import tensorflow as tf
-from tqdm import tqdm
 
 tf.enable_eager_execution()
 # tf.set_random_seed(444)
 np.random.seed(444)
 
-_tqdm = lambda t, s, i: tqdm(
-    ncols=80,
-    total=s,
-    bar_format='%s epoch %d | {l_bar}{bar} | Remaining: {remaining}' % (t, i))
 
+def metrics(y, pred):
+    model_loss = tf.keras.losses.mean_absolute_error(y[:, tf.newaxis], pred)
+    return model_loss, model_loss / y
 
-def main():
+
+def main(args):
     batch_size = 16
     # 1. Get datasets
     ts = int(1e0)
@@ -45,52 +44,26 @@ def main():
     dss = [("train", train_ds), ("test", test_ds)]
 
     # 2. Define model
-    models = [("Z5", GroupInvariance(Z5, 2), poly_Z5),
-              ("D8", GroupInvariance(D8, 2), poly_D8),
-              ("A4", GroupInvariance(A4, 2), poly_A4),
-              ("S4", GroupInvariance(S4, 2), poly_S4)]
+    models = [("Z5", lambda: GroupInvariance(Z5, 2), poly_Z5),
+              ("D8", lambda: GroupInvariance(D8, 2), poly_D8),
+              ("A4", lambda: GroupInvariance(A4, 2), poly_A4),
+              ("S4", lambda: GroupInvariance(S4, 2), poly_S4)]
     base_name = "my_inv_fc"
 
     results = []
-    for name, model, poly in models:
+    for name, model_fn, poly in models:
         path = "./paper/poly_" + name + "/"
-        for ds_name, ds in dss:
-            mae = []
-            mape = []
-            times = []
-            for i in range(1, 11):
-                best_path = sorted(glob(path + base_name + "_" + str(i) + "/checkpoints/best*.index"),
-                                   key=lambda x: (len(x), x))[-1].replace(".index", "")
-                model.load_weights(best_path).expect_partial()
-
-                acc = []
-                per = []
-                for i in range(len(ds)):
-                    # 5. Run everything
-                    start = time()
-                    pred = model(ds[i])
-                    if len(pred) == 2:
-                        pred, L = pred
-                    times.append(time() - start)
-
-                    y = poly(ds[i])[:, tf.newaxis]
-                    model_loss = tf.keras.losses.mean_absolute_error(y, pred)
-                    f = model_loss / y
-                    acc = acc + list(model_loss.numpy())
-                    per = per + list(f.numpy())
-
-                print(np.mean(acc))
-                mae.append(np.mean(acc))
-                mape.append(np.mean(per))
-            results.append((name, ds_name, np.mean(mape), np.std(mape), np.mean(times[1:]), np.std(times[1:])))
-            print(name, ds_name, np.mean(mae), np.std(mae), np.mean(mape), np.std(mape))
-            print(np.mean(times[1:]))
-            print(np.std(times[1:]))
-
-    with open("./paper/poly_m.csv", 'w') as fh:
-        for r in results:
-            fh.write("%s\t%s\t%.5f\t%.5f\t%.6f\t%.6f\n" % r)
+        splits = [(ds_name, [(x, poly(x)) for x in ds]) for ds_name, ds in dss]
+        checkpoints = [best_checkpoint(path + base_name + "_" + str(i)) for i in range(1, 11)]
+        results += evaluate_model(name, model_fn, checkpoints, splits, metrics, args.workers, args.warmup,
+                                  args.repeats, args.ensemble)
+
+    # MAPE
+    write_results("./paper/poly_m.csv", results, metric=1)
 
 
 if __name__ == '__main__':
-    main()
+    parser = ArgumentParser()
+    add_evaluation_args(parser)
+    args = parser.parse_args()
+    main(args)
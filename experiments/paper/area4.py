@@ -1,18 +1,19 @@
-def pm(d):
-    return "%.1f $\pm$ %.1f" % d
+import inspect
+import os
+import sys
 
-with open("./area4.csv", 'r') as fh:
-    lines = fh.read().split("\n")[:-1]
-    data = [line.split("\t") for line in lines]
-    names = [x[0] for x in data]
-    data = [(float(x[2])*1e3, float(x[3])*1e3) for x in data]
-    print(data)
-    print(names)
-    for i in range(int(len(data) / 3)):
-        p = 3*i
-        #print(names[p])
-        #print(data[p], data[p+1], data[p+2])
-        t = " & ".join([names[p], pm(data[p]), pm(data[p+1]), pm(data[p+2])])
-        #t = " & ".join([pm(data[p]), pm(data[p+1]), pm(data[p+2])]) + " & "
-        print(t)
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+rootdir = os.path.dirname(os.path.dirname(currentdir))
+sys.path.insert(0, rootdir)
 
+# add root to pythonpath
+from utils.results import read_results, pm
+
+data = read_results("./area4.csv")
+print(data)
+for i in range(int(len(data) / 3)):
+    p = 3*i
+    # train, val and test of a model
+    t = " & ".join([data["name"][p]] + [pm(data["mean"][j], data["std"][j], 1e3) for j in range(p, p + 3)])
+    #t = " & ".join([pm(data["mean"][j], data["std"][j], 1e3) for j in range(p, p + 3)]) + " & "
+    print(t)
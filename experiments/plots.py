@@ -1,8 +1,18 @@
-from glob import glob
+import inspect
+import os
+import sys
+
 import numpy as np
 import matplotlib.pyplot as plt
 from scipy.signal import savgol_filter
 
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0, parentdir)
+
+# add parent (root) to pythonpath
+from utils.results import ResultsStore
+
 
 def tsplot(data, label):
     m = np.mean(data, axis=0)
@@ -23,25 +33,20 @@ end = 1250
 #names = ["maron_sw", "conv_my_inv"]
 names = ["Z3", "S3", "S3xS2"]
 plot_names = [r"$\mathbb{Z}_3$", r"$S_3$", r"$S_3 \times S_2$"]
-#path = "./paper/poly/"
-#path = "./working_dir/poly_GH_tr160/"
-path = "./paper/poly_GH/"
+#path, runs = "./paper/", "poly/"
+#path, runs = "./working_dir/", "poly_GH_tr160/"
+path, runs = "./paper/", "poly_GH/"
+#metric = "loss"
+metric = "mape"
+# the run CSVs are parsed once into <path>/results.npz, only the new and changed ones later
+store = ResultsStore(path)
+store.ingest()
 for k, base_name in enumerate(names):
-    seq = []
-    for i in range(1, 11):
-        training_path = glob(path + base_name + "_" + str(i) + "/*.csv")[0]
-        data = np.genfromtxt(training_path, delimiter=",", dtype=None)
-        data = np.array([x[2] for x in data])
-        #data = np.reshape(data, (-1, 2))
-        data = np.reshape(data, (-1, 4))
-        seq.append(data)
-
-    data = np.stack(seq, axis=0)
-    print(data.shape)
-    #tsplot(data[:, start:end, 1], plot_names[k] + " TRAIN")
-    #tsplot(data[:, start:end, 3], plot_names[k] + " VAL")
-    tsplot(data[:, start:end, 1], plot_names[k] + " TRAIN")
-    tsplot(data[:, start:end, 3], plot_names[k] + " VAL")
+    _, train = store.curves("TRAIN", metric, model=runs + base_name)
+    _, val = store.curves("VAL", metric, model=runs + base_name)
+    print(train.shape)
+    tsplot(train[:, start:end], plot_names[k] + " TRAIN")
+    tsplot(val[:, start:end], plot_names[k] + " VAL")
 plt.xlabel("Number of epochs")
 #plt.ylabel("MAE")
 plt.ylabel("MAPE")
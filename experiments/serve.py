@@ -0,0 +1,182 @@
+import inspect
+import json
+import os
+import queue
+import sys
+import threading
+from argparse import ArgumentParser
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import perf_counter
+
+import numpy as np
+
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0, parentdir)
+
+# add parent (root) to pythonpath
+from models.export import build_model
+from utils.execution import model_output
+
+import tensorflow as tf
+
+tf.enable_eager_execution()
+
+
+class _Request:
+    def __init__(self, x):
+        self.x = x
+        self.start = perf_counter()
+        self.done = threading.Event()
+        self.y = None
+        self.error = None
+
+
+class MicroBatcher:
+    '''collects the concurrent requests into batches of up to max_batch samples, waiting at most max_wait seconds
+    after the first one, and runs the model on them in a single worker thread'''
+
+    def __init__(self, model, max_batch=64, max_wait=0.005, history=10000):
+        self.model = model
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.latencies = deque(maxlen=history)
+        self.fill = deque(maxlen=history)
+        self.requests = 0
+        self.batches = 0
+        self.worker = threading.Thread(target=self._run, daemon=True)
+        self.worker.start()
+
+    def predict(self, x):
+        '''x is (samples, ...) float32, blocks until the predictions (samples,) are ready'''
+        r = _Request(x)
+        self.queue.put(r)
+        r.done.wait()
+        if r.error is not None:
+            raise r.error
+        return r.y
+
+    def _collect(self):
+        batch = [self.queue.get()]
+        size = len(batch[0].x)
+        deadline = perf_counter() + self.max_wait
+        while size < self.max_batch:
+            timeout = deadline - perf_counter()
+            if timeout <= 0:
+                break
+            try:
+                r = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            batch.append(r)
+            size += len(r.x)
+        return batch, size
+
+    def _run(self):
+        while True:
+            batch, size = self._collect()
+            try:
+                x = np.concatenate([r.x for r in batch], axis=0)
+                pred, _ = model_output(self.model(x))
+                y = np.asarray(pred)[:, 0]
+                splits = np.cumsum([len(r.x) for r in batch])[:-1]
+                for r, v in zip(batch, np.split(y, splits)):
+                    r.y = v
+            except Exception as e:
+                for r in batch:
+                    r.error = e
+            end = perf_counter()
+            with self.lock:
+                self.batches += 1
+                self.requests += len(batch)
+                self.fill.append(size / self.max_batch)
+                self.latencies.extend(end - r.start for r in batch)
+            for r in batch:
+                r.done.set()
+
+    def stats(self):
+        with self.lock:
+            latencies = np.array(self.latencies)
+            fill = np.array(self.fill)
+            s = {"queue_depth": self.queue.qsize(), "requests": self.requests, "batches": self.batches,
+                 "max_batch": self.max_batch, "max_wait": self.max_wait}
+        if len(latencies):
+            s.update({"fill_ratio": float(np.mean(fill)),
+                      "latency_p50": float(np.percentile(latencies, 50)),
+                      "latency_p99": float(np.percentile(latencies, 99))})
+        return s
+
+
+def make_handler(batcher, shape):
+    class Handler(BaseHTTPRequestHandler):
+        '''POST /predict {"inputs": [sample, ...]} -> {"outputs": [...]}, GET /stats'''
+
+        def _reply(self, code, body):
+            data = json.dumps(body).encode()
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if self.path == "/stats":
+                self._reply(200, batcher.stats())
+            else:
+                self._reply(404, {"error": "unknown path %s" % self.path})
+
+        def do_POST(self):
+            if self.path != "/predict":
+                self._reply(404, {"error": "unknown path %s" % self.path})
+                return
+            try:
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+                x = np.asarray(body["inputs"], dtype=np.float32)
+                if x.shape[1:] != shape:
+                    raise ValueError("Expected inputs of shape (samples, %s), got %s" % (
+                        ", ".join(str(d) for d in shape), x.shape))
+            except (ValueError, KeyError, TypeError) as e:
+                self._reply(400, {"error": str(e)})
+                return
+            try:
+                self._reply(200, {"outputs": batcher.predict(x).tolist()})
+            except Exception as e:
+                self._reply(500, {"error": str(e)})
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def main(args):
+    model, shape = build_model(args.family, args.model, args.group, args.num_features, args.checkpoint)
+    batcher = MicroBatcher(model, args.max_batch, args.max_wait / 1000.)
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(batcher, shape))
+    print("serving %s %s on http://%s:%d" % (args.family, args.model, args.host, server.server_address[1]))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(json.dumps(batcher.stats()))
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('--family', type=str, default="area", choices=["area", "poly"])
+    parser.add_argument('--model', type=str, default="GroupInvariance",
+                        choices=["GroupInvariance", "GroupInvarianceConv", "SimpleNet", "Conv1d", "Maron"])
+    parser.add_argument('--group', type=str, default="Z4")
+    parser.add_argument('--num-features', type=int, default=2)
+    parser.add_argument('--checkpoint', type=str, default=None)
+    parser.add_argument('--host', type=str, default="127.0.0.1")
+    parser.add_argument('--port', type=int, default=8500)
+    parser.add_argument('--max-batch', type=int, default=64)
+    parser.add_argument('--max-wait', type=float, default=5., help="milliseconds")
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,253 @@
+import csv
+import inspect
+import itertools
+import json
+import os
+import queue
+import re
+import shutil
+import subprocess
+import sys
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+from time import time
+
+import numpy as np
+
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0, parentdir)
+
+# add parent (root) to pythonpath
+from utils.execution import parse_cpus
+from utils.permutation_groups import group as permutation_group
+
+AXES = ["model", "group", "n", "seed"]
+INDEX_FIELDS = ["out_name", "status", "returncode", "seconds"] + AXES + \
+               ["epochs", "best_epoch", "best_val", "last_val", "csv"]
+
+
+def read_config(path):
+    '''--key=value pairs of a config file (see config_files/README.md)'''
+    config = {}
+    if path is None:
+        return config
+    with open(path, 'r') as fh:
+        for token in fh.read().split():
+            key, _, value = token.partition("=")
+            config[key] = value
+    return config
+
+
+def script_flags(path):
+    '''the --flags of the argument parser of a training script'''
+    with open(path, 'r') as fh:
+        return set(re.findall(r"add_argument\('--([\w-]+)'", fh.read()))
+
+
+def check_axes(args):
+    '''an axis the script does not accept would be dropped by its parse_known_args, giving identical runs'''
+    flags = script_flags(os.path.join(currentdir, args.script))
+    missing = [a for a in AXES if getattr(args, a + "s") and a not in flags]
+    if missing:
+        raise ValueError("%s does not accept %s" % (args.script, ", ".join("--" + a for a in missing)))
+
+
+def expand(args):
+    '''jobs for all the combinations of the given axes, an axis which is not given is not passed to the script'''
+    axes = [(a, getattr(args, a + "s")) for a in AXES if getattr(args, a + "s")]
+    jobs = []
+    for values in itertools.product(*[v for _, v in axes]):
+        params = dict(zip([a for a, _ in axes], values))
+        out_name = args.out_name.format(**params) if args.out_name else \
+            os.path.join(args.prefix, "_".join("%s%s" % ("" if a == "model" else a[0], v) for a, v in params.items()))
+        jobs.append((params, out_name))
+    return jobs
+
+
+def run_names(out_name, replicas):
+    '''the run directories of a job, <out_name>_<k> for every replica of a --replicas job'''
+    return [out_name] if replicas == 1 else ["%s_%d" % (out_name, k + 1) for k in range(replicas)]
+
+
+def command(args, params, out_name):
+    cmd = [sys.executable, args.script]
+    if args.config_file:
+        cmd += ["--config-file", args.config_file]
+    cmd += ["--%s=%s" % (a, v) for a, v in params.items()]
+    if args.replicas > 1:
+        cmd += ["--replicas=%d" % args.replicas]
+    # the interrupted runs continue from their last checkpoint
+    cmd += ["--out-name", out_name, "--threads=%d" % args.threads, "--resume"] + args.extra
+    return cmd
+
+
+def read_csv(path):
+    '''(epochs, best epoch, best and last validation loss) of a run CSV; the first VAL line of every epoch is the
+    loss, the poly_groups script writes the MAPE in a second one'''
+    val = {}
+    with open(path, 'r') as fh:
+        for line in fh:
+            parts = [p.strip() for p in line.split(",")]
+            if len(parts) == 3 and parts[0] == "VAL" and int(parts[1]) not in val:
+                val[int(parts[1])] = float(parts[2])
+    if not val:
+        return 0, None, None, None
+    epochs = sorted(val)
+    best = min(epochs, key=lambda e: val[e])
+    return epochs[-1] + 1, best, val[best], val[epochs[-1]]
+
+
+def find_csv(run_path):
+    if not os.path.isdir(run_path):
+        return None
+    names = sorted(f for f in os.listdir(run_path) if f.endswith(".csv"))
+    return os.path.join(run_path, names[0]) if names else None
+
+
+def finished(run_path, num_epochs):
+    '''the run CSV contains the validation of the last epoch, or the run was stopped early (see best.json)'''
+    manifest = os.path.join(run_path, "best.json")
+    if os.path.exists(manifest):
+        with open(manifest, 'r') as fh:
+            if json.load(fh).get("stopped_epoch") is not None:
+                return True
+    path = find_csv(run_path)
+    return path is not None and num_epochs is not None and read_csv(path)[0] >= num_epochs
+
+
+def run_job(cmd, run_path, log_path, cpus):
+    '''runs the training script pinned to the cpus (taken from and returned to the queue) with its output logged'''
+    cpu_set = cpus.get()
+    env = dict(os.environ, OMP_NUM_THREADS=str(len(cpu_set)))
+    os.makedirs(run_path, exist_ok=True)
+    start = time()
+    try:
+        with open(log_path, 'w') as log:
+            p = subprocess.Popen(cmd, cwd=currentdir, stdout=log, stderr=subprocess.STDOUT, env=env,
+                                 preexec_fn=lambda: os.sched_setaffinity(0, cpu_set))
+            returncode = p.wait()
+    finally:
+        cpus.put(cpu_set)
+    return returncode, time() - start
+
+
+def index_rows(params, out_name, working_path, replicas, status, returncode=None, seconds=None):
+    '''a row for every run of the job, the replica k of a seed s is indexed as the seed s + k'''
+    rows = []
+    for k, name in enumerate(run_names(out_name, replicas)):
+        row = dict(params, out_name=name, status=status, returncode=returncode,
+                   seconds=None if seconds is None else "%.1f" % seconds)
+        if "seed" in params:
+            row["seed"] = params["seed"] + k
+        path = find_csv(os.path.join(working_path, name))
+        if path is not None:
+            row["epochs"], row["best_epoch"], row["best_val"], row["last_val"] = read_csv(path)
+            row["csv"] = os.path.relpath(path, working_path)
+        rows.append(row)
+    return rows
+
+
+def write_index(rows, path):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp = path + ".%d.tmp" % os.getpid()
+    with open(tmp, 'w', newline='') as fh:
+        w = csv.DictWriter(fh, INDEX_FIELDS, restval="")
+        w.writeheader()
+        w.writerows(r for job in rows if job is not None for r in job)
+    os.replace(tmp, path)
+
+
+def main(args):
+    config = read_config(os.path.join(currentdir, args.config_file) if args.config_file else None)
+    working_path = os.path.join(currentdir, args.working_path or config.get("--working-path", "./working_dir"))
+    num_epochs = args.num_epochs or config.get("--num-epochs")
+    num_epochs = None if num_epochs is None else int(num_epochs)
+    args.index = args.index or os.path.join(working_path, "sweep_index.csv")
+    args.replicas = args.replicas or int(config.get("--replicas", 1))
+    if args.num_epochs:
+        args.extra += ["--num-epochs=%d" % args.num_epochs]
+    if args.working_path:
+        args.extra += ["--working-path=%s" % args.working_path]
+    check_axes(args)
+    for g in args.groups or []:
+        permutation_group(g)
+
+    available = os.sched_getaffinity(0)
+    cpus = parse_cpus(args.cpus) if args.cpus else sorted(available)
+    if not set(cpus) <= available:
+        raise ValueError("The cpus %s are not available" % sorted(set(cpus) - available))
+    workers = args.workers or max(1, len(cpus) // args.threads)
+    if workers * args.threads > len(cpus):
+        raise ValueError("%d workers x %d threads do not fit into %d cpus" % (workers, args.threads, len(cpus)))
+    cpu_sets = queue.Queue()
+    for k in range(workers):
+        cpu_sets.put(cpus[k * args.threads:(k + 1) * args.threads])
+
+    jobs = expand(args)
+    rows = [None] * len(jobs)
+    pending = []
+    for k, (params, out_name) in enumerate(jobs):
+        names = run_names(out_name, args.replicas)
+        if not args.force and all(finished(os.path.join(working_path, n), num_epochs) for n in names):
+            rows[k] = index_rows(params, out_name, working_path, args.replicas, "skipped")
+        else:
+            pending.append(k)
+    print("%d jobs, %d finished, %d to run on %d workers x %d threads" % (
+        len(jobs), len(jobs) - len(pending), len(pending), workers, args.threads))
+    if args.dry_run:
+        for k in pending:
+            print(" ".join(command(args, *jobs[k])))
+        return
+
+    with ThreadPoolExecutor(workers) as pool:
+        futures = {}
+        for k in pending:
+            params, out_name = jobs[k]
+            run_path = os.path.join(working_path, out_name)
+            if args.force:
+                # a forced job would resume from its final state, it is rerun from scratch
+                for name in set([out_name] + run_names(out_name, args.replicas)):
+                    shutil.rmtree(os.path.join(working_path, name), ignore_errors=True)
+            futures[k] = pool.submit(run_job, command(args, params, out_name), run_path,
+                                     os.path.join(run_path, "sweep.log"), cpu_sets)
+        for k in pending:
+            params, out_name = jobs[k]
+            returncode, seconds = futures[k].result()
+            status = "done" if returncode == 0 else "failed"
+            print("%-6s %s (%.0f s)" % (status, out_name, seconds))
+            rows[k] = index_rows(params, out_name, working_path, args.replicas, status, returncode, seconds)
+            write_index(rows, args.index)
+
+    write_index(rows, args.index)
+    rows = [r for job in rows for r in job]
+    failed = sum(r["status"] == "failed" for r in rows)
+    print("index written to %s, %d failed" % (args.index, failed))
+    values = [r["best_val"] for r in rows if r.get("best_val") is not None]
+    if values:
+        print("best validation loss: mean %.6f, min %.6f" % (np.mean(values), np.min(values)))
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('--script', type=str, default="invariance_area.py")
+    parser.add_argument('--config-file', type=str, default=None, help="relative to experiments/")
+    parser.add_argument('--models', type=str, nargs='*')
+    parser.add_argument('--groups', type=str, nargs='*')
+    parser.add_argument('--ns', type=int, nargs='*')
+    parser.add_argument('--seeds', type=int, nargs='*')
+    parser.add_argument('--out-name', type=str, default=None,
+                        help="template of the run names, e.g. area_nmid/{model}_{n}_{seed}")
+    parser.add_argument('--prefix', type=str, default="sweep")
+    parser.add_argument('--working-path', type=str, default=None)
+    parser.add_argument('--num-epochs', type=int, default=None)
+    parser.add_argument('--replicas', type=int, default=None, help="trained by every job, see config_files/README.md")
+    parser.add_argument('--threads', type=int, default=1, help="CPU threads of every job")
+    parser.add_argument('--cpus', type=str, default=None, help="e.g. 0-15, all the available ones by default")
+    parser.add_argument('--workers', type=int, default=None, help="cpus // threads by default")
+    parser.add_argument('--index', type=str, default=None, help="<working path>/sweep_index.csv by default")
+    parser.add_argument('--force', action='store_true', help="remove the run directories, rerun from scratch")
+    parser.add_argument('--dry-run', action='store_true')
+    args, extra = parser.parse_known_args()
+    args.extra = extra
+    main(args)
@@ -3,21 +3,23 @@ from itertools import permutations
 import tensorflow as tf
 import numpy as np
 
-from models.ginv import sigmaPi, prepare_permutation_matices
-from utils.other import partitionfunc, groupAvereaging, apply_layers
+from models.ginv import sigmaPiReduce, prepare_permutation_indices
+from utils.other import partitionfunc, batchedGroupAveraging, apply_layers
+from utils.permutation_groups import Z4
 
 tf.enable_eager_execution()
 
 
 class GroupInvariance(tf.keras.Model):
-    def __init__(self, perm, num_features):
+    def __init__(self, perm, num_features, reduction='prod'):
         super(GroupInvariance, self).__init__()
         activation = tf.keras.activations.tanh
 
         self.num_features = num_features
+        self.reduction = reduction
         self.n = len(perm[0])
         self.m = len(perm)
-        self.p = prepare_permutation_matices(perm, self.n, self.m)
+        self.idx = prepare_permutation_indices(perm, self.n, self.m)
 
         self.features = [
             tf.keras.layers.Dense(16, activation),
@@ -33,20 +35,21 @@ class GroupInvariance(tf.keras.Model):
     def call(self, x):
         x = apply_layers(x, self.features)
         x = tf.reshape(x, (-1, self.n, self.num_features, self.n))
-        x = sigmaPi(x, self.m, self.n, self.p)
+        x = sigmaPiReduce(x, self.idx, self.reduction)
         x = apply_layers(x, self.fc)
         return x
 
 
 class GroupInvarianceConv(tf.keras.Model):
-    def __init__(self, perm, num_features):
+    def __init__(self, perm, num_features, reduction='prod'):
         super(GroupInvarianceConv, self).__init__()
         activation = tf.keras.activations.tanh
 
         self.num_features = num_features
+        self.reduction = reduction
         self.n = len(perm[0])
         self.m = len(perm)
-        self.p = prepare_permutation_matices(perm, self.n, self.m)
+        self.idx = prepare_permutation_indices(perm, self.n, self.m)
 
         self.features = [
             tf.keras.layers.Conv1D(32, 3, activation=activation),
@@ -64,14 +67,15 @@ class GroupInvarianceConv(tf.keras.Model):
         #x = tf.reshape(x, (-1, self.n, self.num_features, self.n))
         x = tf.reshape(x, (-1, self.n, self.n, self.num_features))  # for the compatibility with already trained models
         x = tf.transpose(x, (0, 1, 3, 2))  # for the compatibility with already trained models
-        x = sigmaPi(x, self.m, self.n, self.p)
+        x = sigmaPiReduce(x, self.idx, self.reduction)
         x = apply_layers(x, self.fc)
         return x
 
 
 class Conv1d(tf.keras.Model):
-    def __init__(self, activation=tf.keras.activations.tanh):
+    def __init__(self, activation=tf.keras.activations.tanh, perm=Z4):
         super(Conv1d, self).__init__()
+        self.perm = np.asarray(perm, dtype=np.int32)
         self.features = [
             tf.keras.layers.Conv1D(32, 3, activation=activation),
             tf.keras.layers.Conv1D(2, 1, padding='same', activation=activation),
@@ -91,13 +95,14 @@ class Conv1d(tf.keras.Model):
         return x
 
     def call(self, inputs):
-        x = groupAvereaging(inputs, self.process)
+        x = batchedGroupAveraging(inputs, self.process, self.perm)
         return x
 
 
 class SimpleNet(tf.keras.Model):
-    def __init__(self):
+    def __init__(self, perm=Z4):
         super(SimpleNet, self).__init__()
+        self.perm = np.asarray(perm, dtype=np.int32)
         self.features = [
             tf.keras.layers.Dense(64, tf.keras.activations.tanh),
             tf.keras.layers.Dense(18, tf.keras.activations.tanh),
@@ -110,7 +115,7 @@ class SimpleNet(tf.keras.Model):
         return x
 
     def call(self, inputs):
-        x = groupAvereaging(inputs, self.process)
+        x = batchedGroupAveraging(inputs, self.process, self.perm)
         return x
 
 
@@ -128,7 +133,7 @@ class MulNet(tf.keras.Model):
 
 
 class Maron(tf.keras.Model):
-    def __init__(self):
+    def __init__(self, perm=Z4):
         super(Maron, self).__init__()
 
         self.features = [
@@ -142,36 +147,23 @@ class Maron(tf.keras.Model):
         self.a = [(x[:2] + (0, 0) + x[2:] + (0, 0)) for x in self.a]
         self.f = np.array(self.a)
 
-    def call(self, x):
-        def inv(a, b, c, d, e, f, g, h):
-            p = self.f
-            x1 = a ** p[:, 0]
-            x2 = b ** p[:, 1]
-            x3 = c ** p[:, 2]
-            x4 = d ** p[:, 3]
-            x5 = e ** p[:, 4]
-            x6 = f ** p[:, 5]
-            x7 = g ** p[:, 6]
-            x8 = h ** p[:, 7]
-            mul = x1 * x2 * x3 * x4 * x5 * x6 * x7 * x8
-            mulnn = self.mulnn(tf.stack([x1, x2, x3, x4, x5, x6, x7, x8], axis=-1))[:, :, 0]
-            mul_loss = tf.keras.losses.mean_absolute_error(mul, mulnn)
-            return mulnn, mul_loss
+        # the group acts on the vertices, so on the x and y coordinates simultaneously
+        perm = np.asarray(perm, dtype=np.int32)
+        self.idx = np.concatenate([perm, perm + perm.shape[1]], axis=1)
 
+    def call(self, x):
         x = tf.transpose(x, (0, 2, 1))
         x = tf.reshape(x, (-1, 8))
-        a, b, c, d, e, f, g, h = tf.unstack(x[:, :, tf.newaxis], axis=1)
-
-        def term():
-            p1, l1 = inv(a, b, c, d, e, f, g, h)
-            p2, l2 = inv(d, a, b, c, h, e, f, g)
-            p3, l3 = inv(c, d, a, b, g, h, e, f)
-            p4, l4 = inv(b, c, d, a, f, g, h, e)
-            q1 = p1 + p2 + p3 + p4
-            L = l1 + l2 + l3 + l4
-            return q1, L
-
-        x, L = term()
+
+        # all monomials for all group elements at once, (batch, |G|, #monomials, 8)
+        x = tf.gather(x, self.idx, axis=1)
+        x = x[:, :, tf.newaxis] ** self.f
+        mul = tf.reduce_prod(x, axis=-1)
+        mulnn = self.mulnn(x)[..., 0]
+        mul_loss = tf.keras.losses.mean_absolute_error(mul, mulnn)
+
+        x = tf.reduce_sum(mulnn, axis=1)
+        L = tf.reduce_sum(mul_loss, axis=1)
 
         x = apply_layers(x, self.features)
 
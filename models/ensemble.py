@@ -0,0 +1,129 @@
+import numpy as np
+import tensorflow as tf
+
+from utils.execution import model_output
+
+tf.enable_eager_execution()
+
+LAYER_LISTS = ("features", "fc")
+
+
+def _stack(weights, trainable):
+    w = np.stack(weights, axis=0)
+    if trainable:
+        return tf.Variable(w)
+    return tf.constant(w)
+
+
+class StackedDense:
+    '''K Dense layers applied at once, the input is (K * batch, ..., in) with the members along the batch'''
+
+    def __init__(self, layers, trainable=False):
+        self.k = len(layers)
+        self.kernel = _stack([l.kernel.numpy() for l in layers], trainable)
+        self.bias = _stack([l.bias.numpy() for l in layers], trainable) if layers[0].use_bias else None
+        self.activation = layers[0].activation
+
+    @property
+    def variables(self):
+        return [v for v in [self.kernel, self.bias] if v is not None]
+
+    def __call__(self, x):
+        shape = tf.shape(x)
+        y = tf.reshape(x, (self.k, -1, int(x.shape[-1]))) @ self.kernel
+        if self.bias is not None:
+            y += self.bias[:, tf.newaxis]
+        y = tf.reshape(y, tf.concat([shape[:-1], [int(self.kernel.shape[-1])]], 0))
+        return self.activation(y)
+
+
+class StackedConv1D:
+    '''K Conv1D layers (stride and dilation 1) applied at once, the input is (K * batch, length, channels)'''
+
+    def __init__(self, layers, trainable=False):
+        assert layers[0].strides == (1,) and layers[0].dilation_rate == (1,)
+        self.k = len(layers)
+        self.kernel = _stack([l.kernel.numpy() for l in layers], trainable)
+        self.bias = _stack([l.bias.numpy() for l in layers], trainable) if layers[0].use_bias else None
+        self.activation = layers[0].activation
+        self.padding = layers[0].padding
+
+    @property
+    def variables(self):
+        return [v for v in [self.kernel, self.bias] if v is not None]
+
+    def __call__(self, x):
+        size, cin, cout = [int(d) for d in self.kernel.shape[1:]]
+        if self.padding == 'same':
+            x = tf.pad(x, [[0, 0], [(size - 1) // 2, size // 2], [0, 0]])
+        length = int(x.shape[1]) - size + 1
+        # convolution as a matmul of the (K, batch * length, size * channels) patches
+        patches = tf.concat([x[:, i:i + length] for i in range(size)], axis=-1)
+        y = tf.reshape(patches, (self.k, -1, size * cin)) @ tf.reshape(self.kernel, (self.k, size * cin, cout))
+        if self.bias is not None:
+            y += self.bias[:, tf.newaxis]
+        y = tf.reshape(y, (-1, length, cout))
+        return self.activation(y)
+
+
+def stack_layers(layers, trainable=False):
+    if isinstance(layers[0], tf.keras.layers.Dense):
+        return StackedDense(layers, trainable)
+    elif isinstance(layers[0], tf.keras.layers.Conv1D):
+        return StackedConv1D(layers, trainable)
+    raise ValueError("Cannot stack %s layers" % type(layers[0]).__name__)
+
+
+class Ensemble:
+    '''K models of the same architecture (GroupInvariance, GroupInvarianceConv, SimpleNet, Conv1d) evaluated in one
+    forward pass; the weights of the members are stacked along the leading axis and the members are folded into
+    the batch, so the unchanged call of the model is reused with the stacked layers'''
+
+    def __init__(self, model_fn, members, trainable=False):
+        self.k = len(members)
+        self.model = model_fn()
+        self.stacked = []
+        for name in LAYER_LISTS:
+            if hasattr(self.model, name):
+                layers = [stack_layers(list(l), trainable) for l in zip(*[getattr(m, name) for m in members])]
+                setattr(self.model, name, layers)
+                self.stacked += layers
+
+    @staticmethod
+    def supports(model):
+        layers = [l for name in LAYER_LISTS if hasattr(model, name) for l in getattr(model, name)]
+        return all(l in layers for l in model.layers)
+
+    @staticmethod
+    def from_checkpoints(model_fn, checkpoints, sample_input, trainable=False):
+        members = []
+        for c in checkpoints:
+            model = model_fn()
+            model.load_weights(c).expect_partial()
+            model(sample_input)
+            members.append(model)
+        return Ensemble(model_fn, members, trainable)
+
+    @property
+    def trainable_variables(self):
+        return [v for l in self.stacked for v in l.variables]
+
+    def __call__(self, x, shared=True):
+        '''x is a single batch fed to all the members, or (K, batch, ...) batches for every member if not shared,
+        returns the (K, batch, ...) predictions'''
+        if shared:
+            x = tf.tile(x, [self.k] + [1] * (len(x.shape) - 1))
+        else:
+            x = tf.reshape(x, [-1] + x.shape[2:].as_list())
+        pred, _ = model_output(self.model.call(x))
+        return tf.reshape(pred, [self.k, -1] + pred.shape[1:].as_list())
+
+    def unstack_to(self, members):
+        '''copies the stacked weights back to the K members (e.g. to save them with save_weights)'''
+        for name in LAYER_LISTS:
+            if hasattr(self.model, name):
+                for stacked, layers in zip(getattr(self.model, name), zip(*[getattr(m, name) for m in members])):
+                    for k, l in enumerate(layers):
+                        l.kernel.assign(stacked.kernel[k])
+                        if stacked.bias is not None:
+                            l.bias.assign(stacked.bias[k])
@@ -0,0 +1,100 @@
+import json
+from argparse import ArgumentParser
+
+import numpy as np
+import tensorflow as tf
+
+import models.area as area
+import models.poly as poly
+from utils.permutation_groups import group as permutation_group
+
+tf.enable_eager_execution()
+
+FORMAT_VERSION = 1
+
+
+def _layer(layer, prefix, arrays):
+    '''description of a Dense / Conv1D layer, its weights are put into arrays under prefix'''
+    if isinstance(layer, tf.keras.layers.Dense):
+        spec = {"type": "dense"}
+    elif isinstance(layer, tf.keras.layers.Conv1D):
+        assert layer.strides == (1,) and layer.dilation_rate == (1,)
+        spec = {"type": "conv1d", "padding": layer.padding}
+    else:
+        raise ValueError("Cannot export %s layers" % type(layer).__name__)
+    spec["activation"] = layer.activation.__name__
+    arrays[prefix + "/kernel"] = layer.kernel.numpy()
+    if layer.use_bias:
+        arrays[prefix + "/bias"] = layer.bias.numpy()
+    spec["use_bias"] = layer.use_bias
+    return spec
+
+
+def _layers(layers, name, arrays):
+    return [_layer(l, "%s/%d" % (name, i), arrays) for i, l in enumerate(layers)]
+
+
+def restore_weights(model, checkpoint):
+    '''restores the save_weights checkpoints as well as the ExperimentHandler ones (the model under the "model" key)'''
+    if any(name.startswith("model/") for name, _ in tf.train.list_variables(checkpoint)):
+        tf.train.Checkpoint(model=model).restore(checkpoint).expect_partial()
+    else:
+        model.load_weights(checkpoint).expect_partial()
+
+
+def build_model(family, name, group, num_features, checkpoint):
+    '''model restored from a checkpoint written by ExperimentHandler or save_weights, built with a dummy batch'''
+    perm = permutation_group(group)
+    module = {"area": area, "poly": poly}[family]
+    if name in ["GroupInvariance", "GroupInvarianceConv"]:
+        model = getattr(module, name)(perm, num_features)
+    else:
+        model = getattr(module, name)(perm=perm)
+    shape = (len(perm[0]), 2) if family == "area" else (len(perm[0]),)
+    if checkpoint is not None:
+        restore_weights(model, checkpoint)
+    model(np.zeros((1,) + shape, dtype=np.float32))
+    return model, shape
+
+
+def export_model(model, path):
+    '''writes a built model (GroupInvariance, GroupInvarianceConv, SimpleNet, Conv1d, Maron from models.area or
+    models.poly) to a single .npz file: the weights, the permutation table and the architecture description,
+    which is read by models.numpy_runtime without TensorFlow'''
+    module = type(model).__module__
+    if module not in [area.__name__, poly.__name__]:
+        raise ValueError("Cannot export %s models" % module)
+    meta = {"version": FORMAT_VERSION, "family": module.split(".")[-1], "model": type(model).__name__}
+    arrays = {}
+
+    meta["features"] = _layers(model.features, "features", arrays)
+    if hasattr(model, "fc"):
+        meta["fc"] = _layers(model.fc, "fc", arrays)
+    if isinstance(model, (area.GroupInvariance, area.GroupInvarianceConv, poly.GroupInvariance,
+                          poly.GroupInvarianceConv)):
+        meta.update({"n": model.n, "m": model.m, "num_features": model.num_features})
+        arrays["idx"] = model.idx
+    elif isinstance(model, (area.Maron, poly.Maron)):
+        meta["mulnn"] = _layers(model.mulnn.fc, "mulnn", arrays)
+        arrays["idx"] = model.idx
+        arrays["f"] = model.f
+    else:
+        arrays["perm"] = model.perm
+
+    arrays["meta"] = np.frombuffer(json.dumps(meta).encode(), dtype=np.uint8)
+    with open(path, 'wb') as fh:
+        np.savez_compressed(fh, **arrays)
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('--family', type=str, default="area", choices=["area", "poly"])
+    parser.add_argument('--model', type=str, default="GroupInvariance",
+                        choices=["GroupInvariance", "GroupInvarianceConv", "SimpleNet", "Conv1d", "Maron"])
+    parser.add_argument('--group', type=str, default="Z4")
+    parser.add_argument('--num-features', type=int, default=2)
+    parser.add_argument('--checkpoint', type=str, required=True)
+    parser.add_argument('--output', type=str, required=True)
+    args = parser.parse_args()
+    model, _ = build_model(args.family, args.model, args.group, args.num_features, args.checkpoint)
+    export_model(model, args.output)
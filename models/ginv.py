@@ -13,9 +13,67 @@ def sigmaPi(fin, m, n, p):
     return y
 
 
+def sigmaPiGather(fin, idx):
+    '''SigmaPi computed with a single gather instead of the tiled permutation matmul.
+    fin is (batch, n, F, n) as in sigmaPi, idx are the flat indices from prepare_permutation_indices'''
+    fin = tf.transpose(fin, (0, 2, 1, 3))
+    s = tf.shape(fin)
+    fin = tf.reshape(fin, (s[0], s[1], -1))
+    y = tf.gather(fin, idx, axis=2)
+    y = tf.reduce_prod(y, axis=3)
+    y = tf.reduce_sum(y, axis=2)
+    return y
+
+
 def prepare_permutation_matices(perm, n, m):
     p1 = np.eye(n, dtype=np.float32)
     p = np.tile(p1[np.newaxis], (m, 1, 1))
     for i, x in enumerate(perm):
         p[i, x, :] = p1[np.arange(n)]
     return p
+
+
+def prepare_permutation_indices(perm, n, m):
+    '''(m, n) int32 table of the entries picked by the diagonal in sigmaPi, i * n + perm[k][i]'''
+    if hasattr(perm, "flat_indices"):
+        return perm.flat_indices
+    perm = np.reshape(np.asarray(perm, dtype=np.int32), (m, n))
+    return np.arange(n, dtype=np.int32)[np.newaxis] * n + perm
+
+
+def sigmaPiStream(fin, idx, chunk=4, log_space=False):
+    '''Streaming variant of sigmaPiGather, the product over positions and the sum over group elements
+    are fused chunk by chunk, so only (batch, F, chunk, n) is materialised at once.
+    With log_space the products are computed as sign * exp(sum log|x|) (exact zeros get no gradient then)'''
+    fin = tf.transpose(fin, (0, 2, 1, 3))
+    s = tf.shape(fin)
+    fin = tf.reshape(fin, (s[0], s[1], -1))
+    y = 0.
+    for k in range(0, len(idx), chunk):
+        t = tf.gather(fin, idx[k:k + chunk], axis=2)
+        if log_space:
+            y += signedLogProdSum(t)
+        else:
+            y += tf.reduce_sum(tf.reduce_prod(t, axis=3), axis=2)
+    return y
+
+
+def signedLogProdSum(x):
+    '''sum over axis 2 of the products over axis 3, computed with the signs and log-magnitudes'''
+    sign = tf.reduce_prod(tf.sign(x), axis=3)
+    l = tf.reduce_sum(tf.log(tf.maximum(tf.abs(x), np.finfo(np.float32).tiny)), axis=3)
+    # sum the terms relative to the largest one, like in the logsumexp
+    lmax = tf.stop_gradient(tf.reduce_max(l, axis=2))
+    return tf.reduce_sum(sign * tf.exp(l - lmax[:, :, tf.newaxis]), axis=2) * tf.exp(lmax)
+
+
+def sigmaPiReduce(fin, idx, reduction='prod', chunk=4):
+    '''reduction: prod - gather + reduce_prod + reduce_sum, stream - chunked fused reduction,
+    log - chunked fused reduction with the products computed in the log-space'''
+    if reduction == 'prod':
+        return sigmaPiGather(fin, idx)
+    elif reduction == 'stream':
+        return sigmaPiStream(fin, idx, chunk)
+    elif reduction == 'log':
+        return sigmaPiStream(fin, idx, chunk, log_space=True)
+    raise ValueError("Unknown sigmaPi reduction: %s" % reduction)
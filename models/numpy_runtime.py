@@ -0,0 +1,135 @@
+import json
+
+import numpy as np
+
+ACTIVATIONS = {
+    "linear": lambda x: x,
+    "tanh": np.tanh,
+    "relu": lambda x: np.maximum(x, 0.),
+    "sigmoid": lambda x: 1. / (1. + np.exp(-x)),
+}
+
+
+def dense(x, kernel, bias=None):
+    y = x @ kernel
+    if bias is not None:
+        y = y + bias
+    return y
+
+
+def conv1d(x, kernel, bias=None, padding='valid'):
+    '''(batch, length, channels) convolution with stride 1, as a matmul of the patches'''
+    size, cin, cout = kernel.shape
+    if padding == 'same':
+        x = np.pad(x, [[0, 0], [(size - 1) // 2, size // 2], [0, 0]], mode='constant')
+    length = x.shape[1] - size + 1
+    patches = np.concatenate([x[:, i:i + length] for i in range(size)], axis=-1)
+    return dense(patches, kernel.reshape(size * cin, cout), bias)
+
+
+def sigmaPi(fin, idx):
+    '''index based sigmaPi, as models.ginv.sigmaPiGather, fin is (batch, n, F, n)'''
+    fin = np.transpose(fin, (0, 2, 1, 3))
+    fin = fin.reshape(fin.shape[0], fin.shape[1], -1)
+    return np.prod(fin[:, :, idx], axis=3).sum(axis=2)
+
+
+class Layers:
+    def __init__(self, specs, name, arrays):
+        self.layers = []
+        for i, spec in enumerate(specs):
+            prefix = "%s/%d" % (name, i)
+            bias = arrays[prefix + "/bias"] if spec["use_bias"] else None
+            self.layers.append((spec, arrays[prefix + "/kernel"], bias))
+
+    def __call__(self, x):
+        for spec, kernel, bias in self.layers:
+            if spec["type"] == "dense":
+                x = dense(x, kernel, bias)
+            else:
+                x = conv1d(x, kernel, bias, spec["padding"])
+            x = ACTIVATIONS[spec["activation"]](x)
+        return x
+
+
+def _wrap(x):
+    return np.concatenate([x[:, -1:], x, x[:, :1]], axis=1)
+
+
+class NumpyModel:
+    '''forward pass of a model exported with models.export.export_model, using only NumPy;
+    the inputs are (batch, 4, 2) quadrangles for the area models and (batch, 5) points for the poly ones'''
+
+    def __init__(self, path):
+        with np.load(path) as data:
+            arrays = {k: data[k] for k in data.files}
+        self.meta = json.loads(arrays.pop("meta").tobytes().decode())
+        self.family = self.meta["family"]
+        self.name = self.meta["model"]
+        self.features = Layers(self.meta["features"], "features", arrays)
+        self.fc = Layers(self.meta.get("fc", []), "fc", arrays)
+        self.mulnn = Layers(self.meta.get("mulnn", []), "mulnn", arrays)
+        self.idx = arrays.get("idx")
+        self.perm = arrays.get("perm")
+        self.f = arrays["f"].astype(np.float32) if "f" in arrays else None
+        self.forward = {
+            "GroupInvariance": self._group_invariance,
+            "GroupInvarianceConv": self._group_invariance_conv,
+            "SimpleNet": self._simple_net,
+            "Conv1d": self._conv1d,
+            "Maron": self._maron,
+        }[self.name]
+
+    def __call__(self, x):
+        '''(batch, 1) predictions'''
+        return self.forward(np.asarray(x, dtype=np.float32))
+
+    def _group_invariance(self, x):
+        n, F = self.meta["n"], self.meta["num_features"]
+        if self.family == "poly":
+            x = x[:, :, np.newaxis]
+        x = self.features(x)
+        x = sigmaPi(x.reshape(-1, n, F, n), self.idx)
+        return self.fc(x)
+
+    def _group_invariance_conv(self, x):
+        n, F = self.meta["n"], self.meta["num_features"]
+        x = _wrap(x)
+        if self.family == "poly":
+            x = x[:, :, np.newaxis]
+        x = self.features(x)
+        x = np.transpose(x.reshape(-1, n, n, F), (0, 1, 3, 2))
+        x = sigmaPi(x, self.idx)
+        return self.fc(x)
+
+    def _group_averaging(self, x, process):
+        m = len(self.perm)
+        x = x[:, self.perm]
+        x = process(x.reshape((-1,) + x.shape[2:]))
+        return x.reshape((-1, m) + x.shape[1:]).mean(axis=1)
+
+    def _simple_net(self, x):
+        if self.family == "area":
+            return self._group_averaging(x, lambda x: self.features(x.reshape(-1, 8)))
+        return self._group_averaging(x, self.features)
+
+    def _conv1d(self, x):
+        def process(x):
+            x = _wrap(x)
+            if self.family == "poly":
+                x = x[:, :, np.newaxis]
+            x = self.features(x)
+            return self.fc(x.reshape(len(x), -1))
+
+        return self._group_averaging(x, process)
+
+    def _maron(self, x):
+        if self.family == "area":
+            x = np.transpose(x, (0, 2, 1)).reshape(-1, 8)
+        x = x[:, self.idx][:, :, np.newaxis] ** self.f
+        x = self.mulnn(x)[..., 0].sum(axis=1)
+        return self.features(x)
+
+
+def load(path):
+    return NumpyModel(path)
@@ -5,42 +5,23 @@ import tensorflow as tf
 from matplotlib import pyplot as plt
 import numpy as np
 
-from models.ginv import prepare_permutation_matices, sigmaPi
-from utils.other import apply_layers, partitionfunc
+from models.ginv import prepare_permutation_indices, sigmaPiReduce
+from utils.other import apply_layers, partitionfunc, batchedGroupAveraging
+from utils.permutation_groups import Z5
 
 tf.enable_eager_execution()
 
 
-def groupAvereaging(inputs, operation):
-    x = inputs
-    a, b, c, d, e = tf.unstack(x, axis=1)
-
-    # Z5 in S5
-    x1 = x
-    x2 = tf.stack([b, c, d, e, a], axis=1)
-    x3 = tf.stack([c, d, e, a, b], axis=1)
-    x4 = tf.stack([d, e, a, b, c], axis=1)
-    x5 = tf.stack([e, a, b, c, d], axis=1)
-
-    x1 = operation(x1)
-    x2 = operation(x2)
-    x3 = operation(x3)
-    x4 = operation(x4)
-    x5 = operation(x5)
-
-    x = tf.reduce_mean(tf.stack([x1, x2, x3, x4, x5], -1), -1)
-    return x
-
-
 class GroupInvariance(tf.keras.Model):
-    def __init__(self, perm, num_features):
+    def __init__(self, perm, num_features, reduction='prod'):
         super(GroupInvariance, self).__init__()
         activation=tf.keras.activations.tanh
 
         self.num_features = num_features
+        self.reduction = reduction
         self.n = len(perm[0])
         self.m = len(perm)
-        self.p = prepare_permutation_matices(perm, self.n, self.m)
+        self.idx = prepare_permutation_indices(perm, self.n, self.m)
 
         self.features = [
             tf.keras.layers.Dense(16, activation),
@@ -59,14 +40,15 @@ class GroupInvariance(tf.keras.Model):
         x = inputs[:, :, tf.newaxis]
         x = apply_layers(x, self.features)
         x = tf.reshape(x, (-1, self.n, self.num_features, self.n))
-        x = sigmaPi(x, self.m, self.n, self.p)
+        x = sigmaPiReduce(x, self.idx, self.reduction)
         x = apply_layers(x, self.fc)
         return x
 
 
 class SimpleNet(tf.keras.Model):
-    def __init__(self):
+    def __init__(self, perm=Z5):
         super(SimpleNet, self).__init__()
+        self.perm = np.asarray(perm, dtype=np.int32)
         activation = tf.keras.activations.tanh
         self.features = [
             tf.keras.layers.Dense(89, activation),
@@ -80,19 +62,20 @@ class SimpleNet(tf.keras.Model):
         return x
 
     def call(self, inputs):
-        x = groupAvereaging(inputs, self.process)
+        x = batchedGroupAveraging(inputs, self.process, self.perm)
         return x
 
 
 class GroupInvarianceConv(tf.keras.Model):
-    def __init__(self, perm, num_features, activation=tf.keras.activations.tanh):
+    def __init__(self, perm, num_features, activation=tf.keras.activations.tanh, reduction='prod'):
         super(GroupInvarianceConv, self).__init__()
         activation = tf.keras.activations.tanh
 
         self.num_features = num_features
+        self.reduction = reduction
         self.n = len(perm[0])
         self.m = len(perm)
-        self.p = prepare_permutation_matices(perm, self.n, self.m)
+        self.idx = prepare_permutation_indices(perm, self.n, self.m)
 
         self.features = [
             tf.keras.layers.Conv1D(32, 3, activation=activation),
@@ -109,14 +92,15 @@ class GroupInvarianceConv(tf.keras.Model):
         x = apply_layers(x, self.features)
         x = tf.reshape(x, (-1, self.n, self.n, self.num_features))
         x = tf.transpose(x, (0, 1, 3, 2))  # for the compatibility with already trained models
-        x = sigmaPi(x, self.m, self.n, self.p)
+        x = sigmaPiReduce(x, self.idx, self.reduction)
         x = apply_layers(x, self.fc)
         return x
 
 
 class Conv1d(tf.keras.Model):
-    def __init__(self):
+    def __init__(self, perm=Z5):
         super(Conv1d, self).__init__()
+        self.perm = np.asarray(perm, dtype=np.int32)
         activation = tf.keras.activations.tanh
         self.last_n = 118
         self.features = [
@@ -138,7 +122,7 @@ class Conv1d(tf.keras.Model):
         return x
 
     def call(self, inputs):
-        x = groupAvereaging(inputs, self.process)
+        x = batchedGroupAveraging(inputs, self.process, self.perm)
         return x
 
 
@@ -159,7 +143,7 @@ class MulNet(tf.keras.Model):
 
 
 class Maron(tf.keras.Model):
-    def __init__(self):
+    def __init__(self, perm=Z5):
         super(Maron, self).__init__()
         activation = tf.keras.activations.tanh
 
@@ -175,34 +159,18 @@ class Maron(tf.keras.Model):
         # Z5 in S5
         self.a = list(set([p for x in partitionfunc(5, 5, l=0) for p in permutations(x)]))
         self.f = np.array(self.a)
+        self.idx = np.asarray(perm, dtype=np.int32)
 
     def call(self, x):
-        def inv(a, b, c, d, e):
-            p = self.f
-            x1 = a ** p[:, 0]
-            x2 = b ** p[:, 1]
-            x3 = c ** p[:, 2]
-            x4 = d ** p[:, 3]
-            x5 = e ** p[:, 4]
-            mul = x1 * x2 * x3 * x4 * x5
-            mulnn = self.mulnn(tf.stack([x1, x2, x3, x4, x5], axis=-1))[:, :, 0]
-            mul_loss = tf.keras.losses.mean_absolute_error(mul, mulnn)
-            return mulnn, mul_loss
-
-        a, b, c, d, e = tf.unstack(x[:, :, tf.newaxis], axis=1)
-
-        def term():
-            # Z5 in S5
-            p1, l1 = inv(a, b, c, d, e)
-            p2, l2 = inv(e, a, b, c, d)
-            p3, l3 = inv(d, e, a, b, c)
-            p4, l4 = inv(c, d, e, a, b)
-            p5, l5 = inv(b, c, d, e, a)
-            q1 = p1 + p2 + p3 + p4 + p5
-            L = (l1 + l2 + l3 + l4 + l5) / 5.
-            return q1, L
-
-        x, L = term()
+        # all monomials for all group elements at once, (batch, |G|, #monomials, 5)
+        x = tf.gather(x, self.idx, axis=1)
+        x = x[:, :, tf.newaxis] ** self.f
+        mul = tf.reduce_prod(x, axis=-1)
+        mulnn = self.mulnn(x)[..., 0]
+        mul_loss = tf.keras.losses.mean_absolute_error(mul, mulnn)
+
+        x = tf.reduce_sum(mulnn, axis=1)
+        L = tf.reduce_mean(mul_loss, axis=1)
 
         x = apply_layers(x, self.features)
 
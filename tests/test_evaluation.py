@@ -0,0 +1,65 @@
+import atexit
+import inspect
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0, parentdir)
+
+# add parent (root) to pythonpath
+from utils.evaluation import best_checkpoint
+from utils.execution import ExperimentHandler
+
+import tensorflow as tf
+
+tf.enable_eager_execution()
+
+
+def _model():
+    model = tf.keras.Sequential([tf.keras.layers.Dense(1)])
+    model(np.zeros((1, 2), np.float32))
+    return model
+
+
+class BestCheckpointTest(unittest.TestCase):
+
+    def setUp(self):
+        self.working_path = tempfile.mkdtemp()
+        model = _model()
+        handler = ExperimentHandler(self.working_path, "run", 1, model, tf.train.AdamOptimizer(1e-3))
+        for epoch, metric in enumerate([1., .5, .7]):
+            model.set_weights([np.full_like(w, epoch) for w in model.get_weights()])
+            handler.update_best(metric, epoch)
+        handler.close()
+        atexit.unregister(handler.close)
+        self.run_path = handler.run_path
+
+    def tearDown(self):
+        shutil.rmtree(self.working_path)
+
+    def test_round_trip(self):
+        with open(os.path.join(self.run_path, "best.json"), 'r') as fh:
+            manifest = json.load(fh)
+        self.assertEqual(manifest["epoch"], 1)
+        checkpoint = best_checkpoint(self.run_path)
+        self.assertEqual(checkpoint, os.path.join(self.run_path, "checkpoints", "best-1"))
+        model = _model()
+        model.load_weights(checkpoint)
+        for w in model.get_weights():
+            np.testing.assert_array_equal(w, 1.)
+
+    def test_missing_checkpoint_falls_back_to_the_newest_one(self):
+        with open(os.path.join(self.run_path, "best.json"), 'w') as fh:
+            json.dump({"epoch": 7, "metric": .1, "stopped_epoch": None, "checkpoint": "checkpoints/best-7"}, fh)
+        self.assertEqual(best_checkpoint(self.run_path), os.path.join(self.run_path, "checkpoints", "best-1"))
+
+
+if __name__ == '__main__':
+    unittest.main()
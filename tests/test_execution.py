@@ -0,0 +1,84 @@
+import atexit
+import inspect
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0, parentdir)
+
+# add parent (root) to pythonpath
+from utils.evaluation import best_checkpoint
+from utils.execution import ExperimentHandler
+
+import tensorflow as tf
+
+tf.enable_eager_execution()
+
+
+def _model():
+    model = tf.keras.Sequential([tf.keras.layers.Dense(1)])
+    model(np.zeros((1, 2), np.float32))
+    return model
+
+
+def _handler(working_path, **kwargs):
+    return ExperimentHandler(working_path, "run", 1, _model(), tf.train.AdamOptimizer(1e-3), **kwargs)
+
+
+def _interrupt(handler):
+    '''waits for the pending writes and drops the handler without close, as a killed run would'''
+    handler.writer.flush()
+    atexit.unregister(handler.close)
+    shutil.rmtree(handler.tmp_path)
+
+
+class ResumeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.working_path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.working_path)
+
+    def test_best_checkpoint_of_the_last_state_is_kept(self):
+        # best-5 is referenced by the state saved at the epoch 9, best-12 is written before the interruption
+        handler = _handler(self.working_path)
+        for epoch, metric in enumerate([1.] * 5 + [.5] + [.6] * 6 + [.1]):
+            handler.update_best(metric, epoch)
+            if epoch == 9:
+                handler.save_state(epoch, epoch, epoch)
+        _interrupt(handler)
+
+        handler = _handler(self.working_path)
+        state = handler.restore_last()
+        self.assertEqual(state["epoch"], 9)
+        checkpoint = best_checkpoint(handler.run_path)
+        self.assertEqual(checkpoint, os.path.join(handler.run_path, "checkpoints", "best-5"))
+        self.assertTrue(os.path.exists(checkpoint + ".index"))
+        self.assertFalse(os.path.exists(os.path.join(handler.run_path, "checkpoints", "best-12.index")))
+        handler.close()
+
+    def test_run_without_a_state_starts_over(self):
+        # interrupted before the first save_state
+        handler = _handler(self.working_path)
+        for epoch, metric in enumerate([1., .5]):
+            handler.write_csv("VAL, %d, %.6f\n" % (epoch, metric))
+            handler.update_best(metric, epoch)
+        _interrupt(handler)
+
+        handler = _handler(self.working_path)
+        self.assertIsNone(handler.restore_last())
+        self.assertFalse(os.path.exists(handler.csv_path))
+        self.assertFalse(os.path.exists(os.path.join(handler.run_path, "best.json")))
+        self.assertEqual(sorted(os.listdir(os.path.join(handler.run_path, "checkpoints"))), ["best", "last_n"])
+        handler.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
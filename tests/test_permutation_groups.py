@@ -0,0 +1,27 @@
+import inspect
+import os
+import sys
+import unittest
+
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0, parentdir)
+
+# add parent (root) to pythonpath
+from utils.permutation_groups import group
+
+
+class ExtendTest(unittest.TestCase):
+
+    def test_new_points_are_fixed(self):
+        g = group("Z4", 6)
+        self.assertEqual(g.degree, 6)
+        self.assertEqual(g.orbits[-2:], [(4,), (5,)])
+
+    def test_smaller_degree_is_refused(self):
+        with self.assertRaises(ValueError):
+            group("Z4", 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
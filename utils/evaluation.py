@@ -0,0 +1,134 @@
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from glob import glob
+from time import perf_counter
+
+import numpy as np
+
+from models.ensemble import Ensemble
+from utils.execution import model_output
+
+
+def best_checkpoint(run_path):
+    '''the best checkpoint recorded in best.json, the newest best-<epoch> one for the runs without it or if the
+    recorded one is missing'''
+    manifest = os.path.join(run_path, "best.json")
+    if os.path.exists(manifest):
+        with open(manifest, 'r') as fh:
+            checkpoint = os.path.join(run_path, json.load(fh)["checkpoint"])
+        if os.path.exists(checkpoint + ".index"):
+            return checkpoint
+    paths = glob(os.path.join(run_path, "checkpoints", "best*.index"))
+    return sorted(paths, key=lambda x: (len(x), x))[-1].replace(".index", "")
+
+
+def evaluate_checkpoint(model_fn, checkpoint, batches, metrics_fn):
+    '''mean of every per-sample metric returned by metrics_fn(y, pred) over all the batches'''
+    model = model_fn()
+    model.load_weights(checkpoint).expect_partial()
+    values = []
+    for x, y in batches:
+        pred, _ = model_output(model(x))
+        values.append([np.asarray(m) for m in metrics_fn(y, pred)])
+    return [np.mean(np.concatenate(v)) for v in zip(*values)]
+
+
+def measure_latency(model_fn, checkpoint, batches, warmup=5, repeats=3):
+    '''latencies of the single model calls, after warmup calls which include the building of the model'''
+    model = model_fn()
+    model.load_weights(checkpoint).expect_partial()
+    for i in range(warmup):
+        model(batches[i % len(batches)][0])
+
+    times = []
+    samples = 0
+    for _ in range(repeats):
+        for x, _ in batches:
+            start = perf_counter()
+            pred, _ = model_output(model(x))
+            np.asarray(pred)
+            times.append(perf_counter() - start)
+            samples += len(x)
+    return np.array(times), samples
+
+
+def _summary(name, split, metrics, times, samples):
+    r = {
+        "name": name,
+        "split": split,
+        "mean": np.mean(metrics, axis=0),
+        "std": np.std(metrics, axis=0),
+        "time_mean": np.mean(times),
+        "time_std": np.std(times),
+        "p50": np.percentile(times, 50),
+        "p90": np.percentile(times, 90),
+        "p99": np.percentile(times, 99),
+        "throughput": samples / np.sum(times),
+    }
+    print("%s %s | %s +- %s | latency p50 %.6f p99 %.6f | %.1f samples/sec" % (
+        name, split, r["mean"], r["std"], r["p50"], r["p99"], r["throughput"]))
+    return r
+
+
+def evaluate_model(name, model_fn, checkpoints, splits, metrics_fn, workers=1, warmup=5, repeats=3, ensemble=False):
+    '''evaluates all the checkpoints (seeds) of a model on every (split name, batches) in splits,
+    the checkpoints are evaluated in parallel threads, while the latency is measured alone on the first one'''
+    if ensemble and Ensemble.supports(model_fn()):
+        return evaluate_ensemble(name, model_fn, checkpoints, splits, metrics_fn, warmup, repeats)
+
+    results = []
+    with ThreadPoolExecutor(workers) as pool:
+        for split, batches in splits:
+            metrics = list(pool.map(lambda c: evaluate_checkpoint(model_fn, c, batches, metrics_fn), checkpoints))
+            times, samples = measure_latency(model_fn, checkpoints[0], batches, warmup, repeats)
+            results.append(_summary(name, split, np.array(metrics), times, samples))
+    return results
+
+
+def evaluate_ensemble(name, model_fn, checkpoints, splits, metrics_fn, warmup=5, repeats=3):
+    '''as evaluate_model, but all the checkpoints are stacked into an Ensemble and evaluated in one forward pass,
+    the latency is the one of the fused call (all members) and the throughput counts the samples of every member'''
+    ensemble = Ensemble.from_checkpoints(model_fn, checkpoints, splits[0][1][0][0])
+    results = []
+    for split, batches in splits:
+        values = []
+        for x, y in batches:
+            pred = ensemble(x)
+            values.append([[np.asarray(m) for m in metrics_fn(y, pred[k])] for k in range(ensemble.k)])
+        # (members, metrics)
+        metrics = np.array([[np.mean(np.concatenate(v)) for v in zip(*[b[k] for b in values])]
+                            for k in range(ensemble.k)])
+
+        for i in range(warmup):
+            ensemble(batches[i % len(batches)][0])
+        times = []
+        samples = 0
+        for _ in range(repeats):
+            for x, _ in batches:
+                start = perf_counter()
+                np.asarray(ensemble(x))
+                times.append(perf_counter() - start)
+                samples += len(x) * ensemble.k
+        results.append(_summary(name, split, metrics, np.array(times), samples))
+    return results
+
+
+def write_results(path, results, metric=0):
+    '''TSV: name, split, metric mean, metric std, latency mean, latency std (as read by the experiments/paper scripts),
+    the latency percentiles and throughput go to <path>_latency.csv'''
+    with open(path, 'w') as fh:
+        for r in results:
+            fh.write("%s\t%s\t%.5f\t%.5f\t%.6f\t%.6f\n" % (r["name"], r["split"], r["mean"][metric], r["std"][metric],
+                                                      r["time_mean"], r["time_std"]))
+    with open(os.path.splitext(path)[0] + "_latency.csv", 'w') as fh:
+        for r in results:
+            fh.write("%s\t%s\t%.6f\t%.6f\t%.6f\t%.1f\n" % (r["name"], r["split"], r["p50"], r["p90"], r["p99"],
+                                                         r["throughput"]))
+
+
+def add_evaluation_args(parser):
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--warmup', type=int, default=5)
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--ensemble', action='store_true')
@@ -1,12 +1,126 @@
 import argparse
+import atexit
+import json
 import os
+import queue
+import shutil
+import tempfile
+import threading
+import traceback
+from glob import glob
+
 import tensorflow as tf
 import tensorflow.contrib as tfc
 
 
+class AsyncWriter:
+    '''runs the submitted I/O jobs in order on a background thread, the bounded queue blocks the training loop
+    only if the writes fall behind by more than queue_size jobs; the errors are raised by flush'''
+
+    def __init__(self, queue_size=16) -> None:
+        super().__init__()
+        self.jobs = queue.Queue(maxsize=queue_size)
+        self.errors = []
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            fn, args = self.jobs.get()
+            try:
+                fn(*args)
+            except Exception as e:
+                traceback.print_exc()
+                self.errors.append(e)
+            finally:
+                self.jobs.task_done()
+
+    def submit(self, fn, *args):
+        self.jobs.put((fn, args))
+
+    def flush(self):
+        '''waits until all the submitted jobs are done'''
+        self.jobs.join()
+        if self.errors:
+            errors, self.errors = self.errors, []
+            raise errors[0]
+
+
+def _copy_checkpoint(src, dst):
+    '''copies the files of the checkpoint prefix src to dst, the .index file last, so a checkpoint which
+    is visible (by its index) is complete'''
+    files = sorted(glob(src + ".*"), key=lambda f: f.endswith(".index"))
+    for f in files:
+        target = dst + f[len(src):]
+        shutil.copyfile(f, target + ".tmp")
+        os.replace(target + ".tmp", target)
+        os.remove(f)
+
+
+def _remove_checkpoint(prefix):
+    for f in sorted(glob(prefix + ".*"), key=lambda f: not f.endswith(".index")):
+        os.remove(f)
+
+
+def _checkpoints(path, kind):
+    '''prefixes of the <kind>-<epoch> checkpoints in path, from the oldest'''
+    prefixes = [f[:-len(".index")] for f in glob(os.path.join(path, kind + "-*.index"))]
+    return sorted(prefixes, key=lambda p: int(p.rsplit("-", 1)[1]))
+
+
+def _truncate_csv(path, epoch):
+    '''drops the lines of the epochs after epoch (written before an interruption)'''
+    if not os.path.exists(path):
+        return
+    with open(path, 'r') as fh:
+        lines = [l for l in fh if int(l.split(",")[1]) <= epoch]
+    with open(path + ".tmp", 'w') as fh:
+        fh.writelines(lines)
+    os.replace(path + ".tmp", path)
+
+
+def _finite(value):
+    return None if value == float("inf") else value
+
+
+def _infinite(value):
+    return float("inf") if value is None else value
+
+
 class ExperimentHandler:
-    def __init__(self, working_path, out_name, log_interval, model, optimizer) -> None:
+    '''summaries, CSV metrics and checkpoints of a run; the CSV lines, summary flushes and checkpoint copies are
+    done by a background writer, the checkpoints are saved to a local temporary directory first, so the training
+    loop does not wait for the (network) file system; only the last keep_last and the best keep_best checkpoints
+    are retained (all of them if 0), along with the best one referenced by last.json; the CSV is named after the
+    model unless csv_name is given.
+    The best weights are kept in memory (see update_best) and written when they improve by more than min_delta
+    or at close, best.json in the run directory records the epoch, metric and checkpoint of the written ones.
+    save_state writes the full training state (model, optimizer and global step, with the epoch and step counters
+    in last.json), restore_last resumes from it'''
+
+    def __init__(self, working_path, out_name, log_interval, model, optimizer, keep_last=3, keep_best=1,
+                 queue_size=16, csv_name=None, patience=None, min_delta=0.) -> None:
         super().__init__()
+        self.run_path = os.path.join(working_path, out_name)
+        self.csv_path = os.path.join(self.run_path, (csv_name or model.name) + ".csv")
+        self.model = model
+        self.patience = patience
+        self.min_delta = min_delta
+        self.best_metric = float("inf")
+        self.best_epoch = None
+        self.best_weights = None
+        self.written_metric = float("inf")
+        self.waiting = 0
+        self.stopped_epoch = None
+        self._written_best_epoch = None
+        # the best checkpoint referenced by last.json is not pruned until a newer state supersedes it
+        self._pinned = None
+        self.keep = {"last_n": keep_last, "best": keep_best}
+        self.saved = {"last_n": [], "best": []}
+        self.tmp_path = tempfile.mkdtemp(prefix="checkpoints-")
+        self.writer = AsyncWriter(queue_size)
+        atexit.register(self.close)
+
         train_log_path = os.path.join(working_path, out_name, 'logs', 'train')
         val_log_path = os.path.join(working_path, out_name, 'logs', 'val')
         self.checkpoints_last_n_path = os.path.join(working_path, out_name, 'checkpoints', 'last_n')
@@ -32,8 +146,162 @@ class ExperimentHandler:
         self.val_writer.set_as_default()
 
     def flush(self):
-        self.train_writer.flush()
-        self.val_writer.flush()
+        '''flushes the summaries in the background'''
+        self.writer.submit(self.train_writer.flush)
+        self.writer.submit(self.val_writer.flush)
+
+    def write_csv(self, line):
+        self.writer.submit(self._append, self.csv_path, line)
+
+    @staticmethod
+    def _append(path, line):
+        with open(path, 'a') as fh:
+            fh.write(line)
+
+    def save_weights(self, kind, epoch):
+        '''model.save_weights as <run>/checkpoints/<kind>-<epoch>, kind is best or last_n'''
+        name = "%s-%d" % (kind, epoch)
+        self.model.save_weights(os.path.join(self.tmp_path, name))
+        self.writer.submit(self._store, kind, name)
+
+    def save_state(self, epoch, train_step, val_step):
+        '''the model, optimizer and global step as <run>/checkpoints/last_n-<epoch>, last.json records the counters
+        and the best metric tracking once the checkpoint is complete'''
+        name = "last_n-%d" % epoch
+        self.ckpt.write(os.path.join(self.tmp_path, name))
+        self.writer.submit(self._store, "last_n", name)
+        state = {"epoch": epoch, "train_step": train_step, "val_step": val_step, "waiting": self.waiting,
+                 "best_epoch": self._written_best_epoch, "best_metric": _finite(self.written_metric),
+                 "checkpoint": os.path.join("checkpoints", name)}
+        self.writer.submit(self._commit_state, state)
+
+    def _commit_state(self, state):
+        '''writes last.json and pins the best checkpoint it references, the one pinned before can be pruned'''
+        self._write_manifest(os.path.join(self.run_path, "last.json"), state)
+        self._pinned = self._best_prefix(state["best_epoch"])
+        self._prune("best")
+
+    def _best_prefix(self, epoch):
+        return None if epoch is None else os.path.join(self.run_path, "checkpoints", "best-%d" % epoch)
+
+    def restore_last(self):
+        '''restores the state saved by save_state (the optimizer slots are restored when they are created), drops
+        the CSV lines and best checkpoints of the later epochs and rewrites best.json from the restored state;
+        returns the state with the epoch and step counters; if there is no saved state the run is reset (see reset)
+        and None is returned'''
+        path = os.path.join(self.run_path, "last.json")
+        if not os.path.exists(path):
+            self.reset()
+            return None
+        with open(path, 'r') as fh:
+            state = json.load(fh)
+        self.ckpt.restore(os.path.join(self.run_path, state["checkpoint"]))
+
+        # the best weights which were kept only in memory are lost, the tracking continues from the written ones
+        self.best_epoch = self._written_best_epoch = state["best_epoch"]
+        self.best_metric = self.written_metric = _infinite(state["best_metric"])
+        self.waiting = state["waiting"]
+        self._pinned = self._best_prefix(self.best_epoch)
+        if self._pinned is not None and not os.path.exists(self._pinned + ".index"):
+            # pruned by an older version of the handler, the tracking starts over
+            self.best_epoch = self._written_best_epoch = self._pinned = None
+            self.best_metric = self.written_metric = float("inf")
+        # the best checkpoints written after the saved state belong to the discarded epochs
+        for prefix in _checkpoints(os.path.join(self.run_path, "checkpoints"), "best"):
+            if int(prefix.rsplit("-", 1)[1]) > state["epoch"]:
+                _remove_checkpoint(prefix)
+        for kind in self.saved:
+            self.saved[kind] = _checkpoints(os.path.join(self.run_path, "checkpoints"), kind)
+        manifest = os.path.join(self.run_path, "best.json")
+        if self.best_epoch is not None:
+            self._write_manifest(manifest, self._manifest())
+        elif os.path.exists(manifest):
+            os.remove(manifest)
+        _truncate_csv(self.csv_path, state["epoch"])
+        return state
+
+    def reset(self):
+        '''removes the CSV, checkpoints and manifests of an earlier attempt, so the run starts as a fresh one'''
+        for kind in self.saved:
+            for prefix in _checkpoints(os.path.join(self.run_path, "checkpoints"), kind):
+                _remove_checkpoint(prefix)
+            self.saved[kind] = []
+        for path in [self.csv_path, os.path.join(self.run_path, "best.json"), os.path.join(self.run_path, "last.json")]:
+            if os.path.exists(path):
+                os.remove(path)
+
+    def _store(self, kind, name):
+        prefix = os.path.join(self.run_path, "checkpoints", name)
+        _copy_checkpoint(os.path.join(self.tmp_path, name), prefix)
+        self.saved[kind].append(prefix)
+        self._prune(kind)
+
+    def _prune(self, kind):
+        '''removes the oldest checkpoints beyond keep[kind], except the pinned one'''
+        removable = [p for p in self.saved[kind] if p != self._pinned]
+        while self.keep[kind] and len(removable) > self.keep[kind]:
+            prefix = removable.pop(0)
+            self.saved[kind].remove(prefix)
+            _remove_checkpoint(prefix)
+
+    def update_best(self, metric, epoch):
+        '''keeps a snapshot of the weights if the (validation) metric improved, it is saved as the best checkpoint
+        if it improved by more than min_delta over the written one; returns True when the training should stop,
+        after patience epochs without an improvement by more than min_delta (the caller stopping calls mark_stopped)'''
+        metric = float(metric)
+        self.waiting = 0 if metric < self.best_metric - self.min_delta else self.waiting + 1
+        current = metric < self.best_metric
+        if current:
+            self.best_metric = metric
+            self.best_epoch = epoch
+            self.best_weights = self.model.get_weights()
+        if metric < self.written_metric - self.min_delta:
+            self._write_best(current)
+        return self.patience is not None and self.waiting >= self.patience
+
+    def mark_stopped(self, epoch):
+        '''records the epoch at which the training loop stopped early, written to best.json at close'''
+        self.stopped_epoch = epoch
+
+    def _write_best(self, current=False):
+        '''saves the snapshot of the best weights (the model holds them already if current)'''
+        if self.best_weights is None or self.written_metric == self.best_metric:
+            return
+        if current:
+            self.save_weights("best", self.best_epoch)
+        else:
+            weights = self.model.get_weights()
+            self.model.set_weights(self.best_weights)
+            self.save_weights("best", self.best_epoch)
+            self.model.set_weights(weights)
+        self.written_metric = self.best_metric
+        self._written_best_epoch = self.best_epoch
+        self._submit_manifest()
+
+    def _manifest(self):
+        return {"epoch": self.best_epoch, "metric": self.best_metric, "stopped_epoch": self.stopped_epoch,
+                "checkpoint": os.path.join("checkpoints", "best-%d" % self.best_epoch)}
+
+    def _submit_manifest(self):
+        self.writer.submit(self._write_manifest, os.path.join(self.run_path, "best.json"), self._manifest())
+
+    @staticmethod
+    def _write_manifest(path, manifest):
+        with open(path + ".tmp", 'w') as fh:
+            json.dump(manifest, fh)
+        os.replace(path + ".tmp", path)
+
+    def close(self):
+        '''writes the best weights kept in memory and waits for all the pending writes, called at exit as well'''
+        if self.tmp_path is None:
+            return
+        self._write_best()
+        if self.stopped_epoch is not None:
+            self._submit_manifest()
+        self.flush()
+        self.writer.flush()
+        shutil.rmtree(self.tmp_path, ignore_errors=True)
+        self.tmp_path = None
 
     def save_best(self):
         self.ckpt.save(self.checkpoints_best_path)
@@ -45,6 +313,101 @@ class ExperimentHandler:
         self.ckpt.restore(path)
 
 
+def set_cpu_threads(threads=None, cpus=None):
+    '''limits the TF thread pools and pins the process to the given cpus, must be called before the first TF op'''
+    if threads:
+        tf.config.threading.set_intra_op_parallelism_threads(threads)
+        tf.config.threading.set_inter_op_parallelism_threads(threads)
+    if cpus:
+        os.sched_setaffinity(0, cpus)
+
+
+def parse_cpus(text):
+    '''"0-3,6" -> [0, 1, 2, 3, 6]'''
+    cpus = []
+    for part in text.split(","):
+        a, _, b = part.partition("-")
+        cpus += list(range(int(a), int(b or a) + 1))
+    return cpus
+
+
+def model_output(pred):
+    '''(prediction, auxiliary loss) for both the plain models and the ones returning a pair, like Maron'''
+    if isinstance(pred, (tuple, list)):
+        return pred[0], pred[1]
+    return pred, 0.
+
+
+def make_train_step(model, optimizer, loss_fn, compiled=False):
+    '''loss_fn(y, pred) returns a tuple of losses, the first one is optimized (along with the auxiliary loss)'''
+    def train_step(x, y):
+        with tf.GradientTape() as tape:
+            pred, L = model_output(model(x))
+            losses = loss_fn(y, pred)
+            total_loss = losses[0] + L
+
+        grads = tape.gradient(total_loss, model.trainable_variables)
+        optimizer.apply_gradients(zip(grads, model.trainable_variables),
+                                  global_step=tf.train.get_or_create_global_step())
+        return losses
+
+    if compiled:
+        return tf.function(train_step)
+    return train_step
+
+
+def make_eval_step(model, loss_fn, compiled=False):
+    def eval_step(x, y):
+        pred, _ = model_output(model(x))
+        return loss_fn(y, pred)
+
+    if compiled:
+        return tf.function(eval_step)
+    return eval_step
+
+
+def _replica_losses(ensemble, loss_fn, y, pred):
+    # the members are folded into the batch for the loss, the losses are returned as (K, batch)
+    k = ensemble.k
+    y = tf.reshape(y, [-1] + y.shape[2:].as_list())
+    pred = tf.reshape(pred, [-1] + pred.shape[2:].as_list())
+    return tuple(tf.reshape(l, [k, -1]) for l in loss_fn(y, pred))
+
+
+def make_replica_train_step(ensemble, optimizer, loss_fn, shared=False, compiled=False):
+    '''as make_train_step for the K members of a trainable Ensemble updated at once, x and y are (K, batch, ...)
+    batches of every member, or a single batch fed to all of them if shared; the losses are (K, batch)'''
+    def train_step(x, y):
+        x, y = tf.convert_to_tensor(x), tf.convert_to_tensor(y)
+        if shared:
+            y = tf.tile(y[tf.newaxis], [ensemble.k] + [1] * len(y.shape))
+        with tf.GradientTape() as tape:
+            losses = _replica_losses(ensemble, loss_fn, y, ensemble(x, shared))
+            # the members do not share weights, so the gradients of the sum are the ones of every member
+            total_loss = losses[0]
+
+        grads = tape.gradient(total_loss, ensemble.trainable_variables)
+        optimizer.apply_gradients(zip(grads, ensemble.trainable_variables),
+                                  global_step=tf.train.get_or_create_global_step())
+        return losses
+
+    if compiled:
+        return tf.function(train_step)
+    return train_step
+
+
+def make_replica_eval_step(ensemble, loss_fn, compiled=False):
+    '''a single batch evaluated by all the members, the losses are (K, batch)'''
+    def eval_step(x, y):
+        y = tf.convert_to_tensor(y)
+        y = tf.tile(y[tf.newaxis], [ensemble.k] + [1] * len(y.shape))
+        return _replica_losses(ensemble, loss_fn, y, ensemble(x))
+
+    if compiled:
+        return tf.function(eval_step)
+    return eval_step
+
+
 class LoadFromFile(argparse.Action):
     def __call__(self, parser, namespace, values, option_string=None):
         setattr(namespace, 'unknownargs', list())
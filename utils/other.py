@@ -1,14 +1,15 @@
+import numpy as np
 import tensorflow as tf
 
 
 def partitionfunc(n, k, l=1):
     '''n is the integer to partition, k is the length of partitions, l is the min partition element size'''
     if k < 1:
-        raise StopIteration
+        return
     if k == 1:
         if n >= l:
             yield (n,)
-        raise StopIteration
+        return
     for i in range(l, n + 1):
         for result in partitionfunc(n - i, k - 1, i):
             yield (i,) + result
@@ -30,6 +31,18 @@ def groupAvereaging(inputs, operation):
     return x
 
 
+def batchedGroupAveraging(inputs, operation, perm):
+    '''Reynolds operator over the group given as a permutation list, all permuted copies
+    are gathered at once and processed by a single call of operation (group axis folded into the batch)'''
+    m = len(perm)
+    x = tf.gather(inputs, np.asarray(perm, dtype=np.int32), axis=1)
+    x = tf.reshape(x, [-1] + x.shape[2:].as_list())
+    x = operation(x)
+    x = tf.reshape(x, [-1, m] + x.shape[1:].as_list())
+    x = tf.reduce_mean(x, 1)
+    return x
+
+
 def apply_layers(x, layers):
     for l in layers:
         x = l(x)
@@ -1,5 +1,9 @@
+import re
+from functools import lru_cache
 from itertools import permutations
 
+import numpy as np
+
 Z4 = [[0, 1, 2, 3], [1, 2, 3, 0], [2, 3, 0, 1], [3, 0, 1, 2]]
 Z5 = [[0, 1, 2, 3, 4], [1, 2, 3, 4, 0], [2, 3, 4, 0, 1], [3, 4, 0, 1, 2], [4, 0, 1, 2, 3]]
 perm = [[0, 1, 2, 3], [1, 2, 3, 0], [2, 3, 0, 1], [3, 0, 1, 2],
@@ -13,3 +17,199 @@ S4 = [list(x) + [4] for x in perm]
 perm = list(permutations(range(3)))
 S3 = [list(x) + [3, 4] for x in perm]
 
+
+class PermutationGroup:
+    '''finite group of permutations of {0, ..., n - 1}, kept as the (m, n) int32 table of its elements in the given
+    order (the element g acts on the inputs as x[g]); it behaves like the list of permutations used so far
+    (len, indexing, iteration, np.asarray), so it can be passed as perm to all the models'''
+
+    def __init__(self, elements, name=None, check=True):
+        self.table = np.array(elements, dtype=np.int32).reshape(len(elements), -1)
+        self.table.setflags(write=False)
+        self.name = name
+        self._cache = {}
+        if check:
+            self._validate()
+
+    def _validate(self):
+        m, n = self.table.shape
+        if not np.all(np.sort(self.table, axis=1) == np.arange(n)):
+            raise ValueError("The elements of the group are not permutations of %d points" % n)
+        codes = self.codes(self.table)
+        if len(np.unique(codes)) != m:
+            raise ValueError("The elements of the group are not unique")
+        if not np.any(np.all(self.table == np.arange(n), axis=1)):
+            raise ValueError("The group does not contain the identity")
+        for g in self.table:
+            if not np.all(np.isin(self.codes(g[self.table]), codes)):
+                raise ValueError("The permutations are not closed under the composition")
+
+    @staticmethod
+    def generated(generators, degree=None, name=None):
+        '''the group generated by the given permutations (closure under the composition, identity first)'''
+        generators = [tuple(int(i) for i in g) for g in generators]
+        n = degree or len(generators[0])
+        generators = [g + tuple(range(len(g), n)) for g in generators]
+        identity = tuple(range(n))
+        elements = [identity]
+        seen = {identity}
+        for g in elements:
+            for s in generators:
+                h = tuple(g[i] for i in s)
+                if h not in seen:
+                    seen.add(h)
+                    elements.append(h)
+        return PermutationGroup(elements, name, check=False)
+
+    @property
+    def order(self):
+        return self.table.shape[0]
+
+    @property
+    def degree(self):
+        return self.table.shape[1]
+
+    def __len__(self):
+        return self.order
+
+    def __getitem__(self, i):
+        return self.table[i]
+
+    def __iter__(self):
+        return iter(self.table)
+
+    def __array__(self, dtype=None):
+        return self.table if dtype is None else self.table.astype(dtype)
+
+    def __repr__(self):
+        return "PermutationGroup(%s, order=%d, degree=%d)" % (self.name, self.order, self.degree)
+
+    def codes(self, table):
+        '''int64 code of every permutation in table, for the fast membership tests'''
+        return np.asarray(table, dtype=np.int64) @ (self.degree ** np.arange(self.degree, dtype=np.int64))
+
+    def _cached(self, key, fn):
+        if key not in self._cache:
+            value = fn()
+            if isinstance(value, np.ndarray):
+                value.setflags(write=False)
+            self._cache[key] = value
+        return self._cache[key]
+
+    def index(self, elements):
+        '''positions of the given permutations in the table'''
+        def lookup():
+            codes = self.codes(self.table)
+            order = np.argsort(codes)
+            return codes[order], order
+
+        codes, order = self._cached("lookup", lookup)
+        c = self.codes(np.asarray(elements))
+        pos = np.searchsorted(codes, c)
+        if np.any(pos >= len(codes)) or np.any(codes[np.minimum(pos, len(codes) - 1)] != c):
+            raise ValueError("Not an element of the group")
+        return order[pos]
+
+    @property
+    def inverse(self):
+        '''(m, n) table of the inverse permutations, inverse[k][g[i]] = i'''
+        return self._cached("inverse", lambda: np.argsort(self.table, axis=1).astype(np.int32))
+
+    @property
+    def inverse_index(self):
+        '''(m,) position of the inverse of every element'''
+        return self._cached("inverse_index", lambda: self.index(self.inverse).astype(np.int32))
+
+    @property
+    def flat_indices(self):
+        '''(m, n) indices i * n + g[i] used by the gather based sigmaPi, see models.ginv.prepare_permutation_indices'''
+        return self._cached("flat_indices",
+                            lambda: np.arange(self.degree, dtype=np.int32)[np.newaxis] * self.degree + self.table)
+
+    @property
+    def orbits(self):
+        '''sorted tuples of the points in every orbit'''
+        def orbits():
+            return sorted({self.orbit(i) for i in range(self.degree)})
+
+        return self._cached("orbits", orbits)
+
+    def orbit(self, point):
+        return tuple(int(i) for i in np.unique(self.table[:, point]))
+
+    def stabiliser(self, point):
+        '''subgroup of the elements which fix the point'''
+        return self._cached(("stabiliser", point), lambda: PermutationGroup(
+            self.table[self.table[:, point] == point], "Stab_%s(%d)" % (self.name, point), check=False))
+
+    def extend(self, degree):
+        '''the same group acting on degree points, the new ones are fixed'''
+        if degree == self.degree:
+            return self
+        if degree < self.degree:
+            raise ValueError("%s acts on %d points, it cannot be extended to %d" % (self.name, self.degree, degree))
+        fixed = np.tile(np.arange(self.degree, degree, dtype=np.int32), (self.order, 1))
+        return PermutationGroup(np.concatenate([self.table, fixed], axis=1), self.name, check=False)
+
+
+def _named(table, name, degree):
+    g = PermutationGroup(table, name, check=False)
+    return g if degree is None else g.extend(degree)
+
+
+@lru_cache(maxsize=None)
+def cyclic(k, degree=None):
+    '''Z_k of the rotations of the first k points, the rest up to degree are fixed'''
+    table = (np.arange(k)[np.newaxis] + np.arange(k)[:, np.newaxis]) % k
+    return _named(table, "Z%d" % k, degree)
+
+
+@lru_cache(maxsize=None)
+def dihedral(k, degree=None):
+    '''D_2k of the symmetries of a k-gon, the k rotations followed by the k reflections'''
+    j = np.arange(k)[np.newaxis]
+    i = np.arange(k)[:, np.newaxis]
+    table = np.concatenate([(j + i) % k, (k - 1 - i - j) % k], axis=0)
+    return _named(table, "D%d" % (2 * k), degree)
+
+
+@lru_cache(maxsize=None)
+def symmetric(k, degree=None):
+    return _named(list(permutations(range(k))), "S%d" % k, degree)
+
+
+@lru_cache(maxsize=None)
+def alternating(k, degree=None):
+    table = np.array(list(permutations(range(k))), dtype=np.int32).reshape(-1, k)
+    inversions = np.sum(np.triu(table[:, :, np.newaxis] > table[:, np.newaxis, :], 1), axis=(1, 2))
+    return _named(table[inversions % 2 == 0], "A%d" % k, degree)
+
+
+@lru_cache(maxsize=None)
+def direct_product(a, b, degree=None):
+    '''a x b, with a acting on the first a.degree points and b on the following b.degree ones'''
+    left = np.repeat(a.table, b.order, axis=0)
+    right = np.tile(b.table + a.degree, (a.order, 1))
+    return _named(np.concatenate([left, right], axis=1), "%sx%s" % (a.name, b.name), degree)
+
+
+FACTORIES = {"Z": cyclic, "D": lambda k, degree=None: dihedral(k // 2, degree), "A": alternating, "S": symmetric}
+GROUPS = {"Z4": Z4, "Z5": Z5, "D8": D8, "A4": A4, "S4": S4, "S3": S3}
+
+
+@lru_cache(maxsize=None)
+def group(name, degree=None):
+    '''group from its name, e.g. Z5, D8, A4, S4, S3xS2 (factors act on consecutive points), padded to degree points;
+    the groups used in the paper keep the order of elements of the lists above'''
+    if name in GROUPS and (degree is None or degree == len(GROUPS[name][0])):
+        return PermutationGroup(GROUPS[name], name, check=False)
+    factors = []
+    for factor in name.split("x"):
+        match = re.fullmatch(r"([ZDAS])(\d+)", factor)
+        if match is None:
+            raise ValueError("Unknown group: %s" % name)
+        factors.append(FACTORIES[match.group(1)](int(match.group(2))))
+    g = factors[0]
+    for f in factors[1:]:
+        g = direct_product(g, f)
+    return g if degree is None else g.extend(degree)
@@ -0,0 +1,223 @@
+import hashlib
+import json
+import os
+import platform
+from argparse import ArgumentParser
+from time import perf_counter
+
+import numpy as np
+import tensorflow as tf
+
+import models.area as area
+import models.poly as poly
+from utils.execution import model_output
+from utils.permutation_groups import group as permutation_group
+
+tf.enable_eager_execution()
+
+STRATEGIES = ["FC_G-inv", "Conv1D_G-inv", "FC_G-avg", "Conv1D_G-avg", "Maron"]
+FLOAT_BYTES = 4
+CACHE_PATH = os.path.join(os.path.expanduser("~"), ".cache", "g-invariant", "planner.json")
+
+
+def build_model(strategy, family, perm, num_features):
+    '''the model of the strategy as built by the training scripts (--model), the family is area or poly'''
+    module = {"area": area, "poly": poly}[family]
+    if strategy == "FC_G-inv":
+        return module.GroupInvariance(perm, num_features)
+    elif strategy == "Conv1D_G-inv":
+        return module.GroupInvarianceConv(perm, num_features)
+    elif strategy == "FC_G-avg":
+        return module.SimpleNet(perm=perm)
+    elif strategy == "Conv1D_G-avg":
+        return module.Conv1d(perm=perm)
+    elif strategy == "Maron":
+        return module.Maron(perm=perm)
+    raise ValueError("Unknown strategy: %s" % strategy)
+
+
+def sample_input(family, perm, batch_size):
+    shape = (batch_size, len(perm[0]), 2) if family == "area" else (batch_size, len(perm[0]))
+    return np.random.rand(*shape).astype(np.float32)
+
+
+class _Cost:
+    '''per sample FLOPs and the sizes of the activations (kept for the backward pass)'''
+
+    def __init__(self):
+        self.flops = 0
+        self.activations = []
+
+    def tensor(self, size, flops=0):
+        self.activations.append(size)
+        self.flops += flops
+
+    def dense(self, layers, rows):
+        for l in layers:
+            cin, cout = [int(d) for d in l.kernel.shape]
+            self.tensor(rows * cout, 2 * rows * cin * cout + 2 * rows * cout)
+        return cout
+
+    def conv(self, layers, length, rows):
+        for l in layers:
+            size, cin, cout = [int(d) for d in l.kernel.shape]
+            length = length if l.padding == 'same' else length - size + 1
+            self.tensor(rows * length * cout, 2 * rows * length * size * cin * cout + 2 * rows * length * cout)
+        return length * cout
+
+    def sigma_pi(self, m, n, num_features):
+        self.tensor(num_features * m * n, num_features * m * n)
+        self.tensor(num_features)
+
+
+def _cost(strategy, family, model, m, n):
+    c = _Cost()
+    width = 2 if family == "area" else 1
+    if strategy == "FC_G-inv":
+        c.dense(model.features, n)
+        c.sigma_pi(m, n, model.num_features)
+        c.dense(model.fc, 1)
+    elif strategy == "Conv1D_G-inv":
+        c.conv(model.features, n + 2, 1)
+        c.sigma_pi(m, n, model.num_features)
+        c.dense(model.fc, 1)
+    elif strategy == "FC_G-avg":
+        c.tensor(m * n * width)
+        c.dense(model.features, m)
+        c.tensor(1, m)
+    elif strategy == "Conv1D_G-avg":
+        c.tensor(m * n * width)
+        c.conv(model.features, n + 2, m)
+        c.dense(model.fc, m)
+        c.tensor(1, m)
+    elif strategy == "Maron":
+        monomials, d = model.f.shape
+        # the powers and the products of all the monomials for all the group elements
+        c.tensor(m * monomials * d, 2 * m * monomials * d)
+        c.tensor(m * monomials, m * monomials * d)
+        c.dense(model.mulnn.fc, m * monomials)
+        c.tensor(monomials, m * monomials)
+        c.dense(model.features, 1)
+    return c
+
+
+def estimate(strategy, family, perm, batch_size, num_features=2):
+    '''analytical FLOPs of a forward pass and the memory of a training step (parameters, Adam slots and gradients,
+    activations kept for the backward pass) of the strategy for a batch'''
+    m, n = len(perm), len(perm[0])
+    model = build_model(strategy, family, perm, num_features)
+    model(sample_input(family, perm, 1))
+    c = _cost(strategy, family, model, m, n)
+    params = int(sum(np.prod(v.shape) for v in model.trainable_variables))
+    return {
+        "strategy": strategy,
+        "num_features": num_features if strategy.endswith("G-inv") else None,
+        "flops": batch_size * c.flops,
+        "memory": FLOAT_BYTES * (4 * params + batch_size * sum(c.activations)),
+        "params": params,
+    }
+
+
+def _calibration_key(strategy, family, perm, batch_size, num_features):
+    table = hashlib.sha1(np.asarray(perm, dtype=np.int32).tobytes()).hexdigest()[:12]
+    return "|".join(str(k) for k in [platform.node(), os.cpu_count(), tf.__version__, strategy, family,
+                                     np.shape(perm), table, batch_size, num_features])
+
+
+def measure(strategy, family, perm, batch_size, num_features=2, warmup=3, repeats=10):
+    '''median latency of a forward pass in seconds'''
+    model = build_model(strategy, family, perm, num_features)
+    x = sample_input(family, perm, batch_size)
+    for _ in range(warmup):
+        np.asarray(model_output(model(x))[0])
+    times = []
+    for _ in range(repeats):
+        start = perf_counter()
+        np.asarray(model_output(model(x))[0])
+        times.append(perf_counter() - start)
+    return float(np.median(times))
+
+
+def calibrate(estimates, family, perm, batch_size, cache_path=CACHE_PATH):
+    '''adds the measured latency to every estimate, the measurements are cached on disk per host and configuration'''
+    cache = {}
+    if os.path.exists(cache_path):
+        with open(cache_path, 'r') as fh:
+            cache = json.load(fh)
+    for e in estimates:
+        key = _calibration_key(e["strategy"], family, perm, batch_size, e["num_features"])
+        if key not in cache:
+            cache[key] = measure(e["strategy"], family, perm, batch_size, e["num_features"] or 2)
+        e["latency"] = cache[key]
+
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    tmp = cache_path + ".%d.tmp" % os.getpid()
+    with open(tmp, 'w') as fh:
+        json.dump(cache, fh, indent=1, sort_keys=True)
+    os.replace(tmp, cache_path)
+    return estimates
+
+
+def _supported(strategy, family, perm):
+    # the area models work on quadrangles, the poly Maron monomials are defined for 5 variables
+    if family == "area":
+        return len(perm[0]) == 4
+    return strategy != "Maron" or len(perm[0]) == 5
+
+
+def plan(family, perm, batch_size, num_features=2, memory_cap=None, calibrated=False, cache_path=CACHE_PATH,
+         strategies=STRATEGIES):
+    '''estimates of the strategies sorted from the cheapest one (by the measured latency if calibrated, by the FLOPs
+    otherwise), num_features is an int or a dict strategy -> int for the G-inv models;
+    the ones which exceed memory_cap (bytes) are marked as not feasible and put at the end'''
+    estimates = []
+    for s in strategies:
+        if not _supported(s, family, perm):
+            continue
+        f = num_features.get(s, 2) if isinstance(num_features, dict) else num_features
+        estimates.append(estimate(s, family, perm, batch_size, f))
+    if calibrated:
+        calibrate(estimates, family, perm, batch_size, cache_path)
+    for e in estimates:
+        e["feasible"] = memory_cap is None or e["memory"] <= memory_cap
+    cost = "latency" if calibrated else "flops"
+    return sorted(estimates, key=lambda e: (not e["feasible"], e[cost]))
+
+
+def choose(family, perm, batch_size, num_features=2, memory_cap=None, calibrated=False, cache_path=CACHE_PATH,
+           strategies=STRATEGIES, verbose=True):
+    '''name of the cheapest strategy meeting the memory cap'''
+    estimates = plan(family, perm, batch_size, num_features, memory_cap, calibrated, cache_path, strategies)
+    if verbose:
+        print_plan(estimates)
+    if not estimates or not estimates[0]["feasible"]:
+        raise ValueError("No strategy fits into the memory cap of %s bytes" % memory_cap)
+    return estimates[0]["strategy"]
+
+
+def print_plan(estimates):
+    for e in estimates:
+        print("%-14s n=%-4s %10.3f MFLOPs %10.3f MB %8d params%s%s" % (
+            e["strategy"], e["num_features"], e["flops"] / 1e6, e["memory"] / 2 ** 20, e["params"],
+            " %.6f s" % e["latency"] if "latency" in e else "", "" if e["feasible"] else " (over the memory cap)"))
+
+
+def add_planner_args(parser):
+    parser.add_argument('--memory-cap', type=float, default=None, help="MB, used with --model auto")
+    parser.add_argument('--calibrate', action='store_true', help="measure the strategies, used with --model auto")
+
+
+def memory_cap_bytes(args):
+    return None if args.memory_cap is None else args.memory_cap * 2 ** 20
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('--family', type=str, default="poly", choices=["area", "poly"])
+    parser.add_argument('--group', type=str, default="Z5")
+    parser.add_argument('--batch-size', type=int, default=64)
+    parser.add_argument('--n', type=int, default=2)
+    add_planner_args(parser)
+    args = parser.parse_args()
+    print_plan(plan(args.family, permutation_group(args.group), args.batch_size, args.n, memory_cap_bytes(args),
+                    args.calibrate))
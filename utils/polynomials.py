@@ -1,55 +1,75 @@
+import numpy as np
 import tensorflow as tf
 
-
-def poly_Z5(x):
-    def inv1(a, b):
-        return a * b ** 2
-
-    a, b, c, d, e = tf.unstack(x, axis=1)
-    q1 = inv1(a, b) + inv1(b, c) + inv1(c, d) + inv1(d, e) + inv1(e, a)
-    return q1
-
-
-def poly_D8(x):
-    def inv1(a, b):
-        return a * b ** 2
-
-    a, b, c, d, e = tf.unstack(x, axis=1)
-    q1 = inv1(a, b) + inv1(b, c) + inv1(c, d) + inv1(d, a) + \
-         inv1(b, a) + inv1(c, b) + inv1(d, c) + inv1(a, d)
-    return q1 + e
-
-
-def poly_A4(x):
-    a, b, c, d, e = tf.unstack(x, axis=1)
-    q1 = a * b + c * d
-    q2 = a * c + b * d
-    q3 = a * d + b * c
-    q4 = a * b * c + a * b * d + a * c * d + b * c * d
-
-    return q1 + q2 + q3 + q4 + e
-
-
-def poly_S4(x):
-    a, b, c, d, e = tf.unstack(x, axis=1)
-    q1 = a * b * c * d
-    return q1 + e
-
-
-def poly_S3xS2(x):
-    a, b, c, d, e = tf.unstack(x, axis=1)
-    q1 = a*b*c + d + e
-    return q1
-
-def poly_S3(x):
-    a, b, c, d, e = tf.unstack(x, axis=1)
-    q1 = a * b * c + 2 * d + e
-    return q1
-
-def poly_Z3(x):
-    def inv1(a, b):
-        return a * b ** 2
-
-    a, b, c, d, e = tf.unstack(x, axis=1)
-    q1 = inv1(a, b) + inv1(b, c) + inv1(c, a) + 2 * d + e
-    return q1
+from utils.permutation_groups import group
+
+
+class Polynomial:
+    '''sum_k c_k prod_i x_i ** e_ki given by the (K, d) exponent table and the (K,) coefficients, evaluated on
+    (batch, d) inputs in TF (by calling it) or in NumPy; the powers x_i ** p up to the highest exponent are
+    computed once, the factors of all the monomials are gathered from them with the (K, d) flat indices
+    i * (p_max + 1) + e_ki and reduced with a single product and matvec'''
+
+    def __init__(self, exponents, coefficients=None, name="poly"):
+        self.exponents = np.array(exponents, dtype=np.int32).reshape(len(exponents), -1)
+        self.coefficients = np.ones(len(self.exponents), np.float32) if coefficients is None else \
+            np.array(coefficients, dtype=np.float32)
+        self.__name__ = name
+        self.max_power = int(np.max(self.exponents))
+        d = self.exponents.shape[1]
+        self.idx = np.arange(d, dtype=np.int32)[np.newaxis] * (self.max_power + 1) + self.exponents
+
+    @staticmethod
+    def invariant(perm, *terms, name="poly"):
+        '''sum of the orbit sums of the (coefficient, exponents) terms under the group, e.g.
+        Polynomial.invariant(Z5, (1, [1, 2, 0, 0, 0])) = a * b ** 2 + b * c ** 2 + c * d ** 2 + d * e ** 2 + e * a ** 2'''
+        perm = np.asarray(perm)
+        exponents = []
+        coefficients = []
+        for c, e in terms:
+            orbit = np.unique(np.asarray(e)[perm], axis=0)
+            exponents.append(orbit)
+            coefficients.append(np.full(len(orbit), c))
+        return Polynomial(np.concatenate(exponents, 0), np.concatenate(coefficients, 0), name)
+
+    @property
+    def degree(self):
+        return int(np.max(np.sum(self.exponents, axis=1)))
+
+    def __call__(self, x):
+        x = tf.convert_to_tensor(x)
+        powers = [tf.ones_like(x), x]
+        for _ in range(2, self.max_power + 1):
+            powers.append(powers[-1] * x)
+        # (batch, d * (p_max + 1))
+        powers = tf.reshape(tf.stack(powers[:self.max_power + 1], axis=-1), (tf.shape(x)[0], -1))
+        monomials = tf.reduce_prod(tf.gather(powers, self.idx, axis=1), axis=-1)
+        return tf.linalg.matvec(monomials, tf.cast(self.coefficients, x.dtype))
+
+    def numpy(self, x):
+        powers = [np.ones_like(x), x]
+        for _ in range(2, self.max_power + 1):
+            powers.append(powers[-1] * x)
+        powers = np.stack(powers[:self.max_power + 1], axis=-1).reshape(len(x), -1)
+        return np.prod(powers[:, self.idx], axis=-1) @ self.coefficients.astype(x.dtype)
+
+    def __repr__(self):
+        return "Polynomial(%s, %d terms, degree %d)" % (self.__name__, len(self.exponents), self.degree)
+
+
+poly_Z5 = Polynomial.invariant(group("Z5"), (1, [1, 2, 0, 0, 0]), name="poly_Z5")
+
+poly_D8 = Polynomial.invariant(group("D8"), (1, [1, 2, 0, 0, 0]), (1, [0, 0, 0, 0, 1]), name="poly_D8")
+
+poly_A4 = Polynomial.invariant(group("A4"), (1, [1, 1, 0, 0, 0]), (1, [1, 1, 1, 0, 0]), (1, [0, 0, 0, 0, 1]),
+                               name="poly_A4")
+
+poly_S4 = Polynomial.invariant(group("S4"), (1, [1, 1, 1, 1, 0]), (1, [0, 0, 0, 0, 1]), name="poly_S4")
+
+poly_S3xS2 = Polynomial.invariant(group("S3xS2"), (1, [1, 1, 1, 0, 0]), (1, [0, 0, 0, 1, 0]), name="poly_S3xS2")
+
+poly_S3 = Polynomial.invariant(group("S3"), (1, [1, 1, 1, 0, 0]), (2, [0, 0, 0, 1, 0]), (1, [0, 0, 0, 0, 1]),
+                               name="poly_S3")
+
+poly_Z3 = Polynomial.invariant(group("Z3", 5), (1, [1, 2, 0, 0, 0]), (2, [0, 0, 0, 1, 0]), (1, [0, 0, 0, 0, 1]),
+                               name="poly_Z3")
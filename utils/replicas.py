@@ -0,0 +1,117 @@
+from time import time
+
+import tensorflow as tf
+import tensorflow.contrib as tfc
+from tqdm import tqdm
+
+from models.ensemble import Ensemble
+from utils.execution import ExperimentHandler, make_replica_train_step, make_replica_eval_step
+
+
+class StackedBatches:
+    '''(K, batch, ...) batches of K datasets of the same size iterated in lockstep, one dataset for every replica'''
+
+    def __init__(self, datasets) -> None:
+        super().__init__()
+        self.datasets = datasets
+
+    def __iter__(self):
+        for batches in zip(*self.datasets):
+            yield tuple(tf.stack(t, axis=0) for t in zip(*batches))
+
+
+def build_replicas(model_fn, k, sample_input):
+    '''K independently initialised models and the trainable Ensemble of their stacked weights'''
+    members = []
+    for _ in range(k):
+        model = model_fn()
+        model(sample_input)
+        members.append(model)
+    if not Ensemble.supports(members[0]):
+        raise ValueError("%s cannot be trained as replicas" % type(members[0]).__name__)
+    return Ensemble(model_fn, members, trainable=True), members
+
+
+def _log_steps(handlers, log, losses, step):
+    for k, h in enumerate(handlers):
+        getattr(h, log)()
+        with tfc.summary.always_record_summaries():
+            tfc.summary.scalar('metrics/model_loss', losses[k], step=step)
+
+
+def _run_epoch(step_fn, ds, title, handlers, log, step, log_interval):
+    '''runs the steps over the dataset, returns the (losses, K) means read back once, the number of steps and
+    the last step'''
+    sums, count, i = 0., 0, -1
+    for i, (x, y) in enumerate(tqdm(ds, title)):
+        losses = step_fn(x, y)
+        # accumulated on the device
+        sums += tf.reduce_sum(tf.stack(losses, axis=0), axis=-1)
+        count += int(losses[0].shape[-1])
+
+        if step % log_interval == 0:
+            _log_steps(handlers, log, losses[0], step)
+        step += 1
+    return (sums / count).numpy(), i + 1, step
+
+
+def train_replicas(args, members, ensemble, optimizer, loss_fn, train_ds, val_ds, shared=False, save_last=True):
+    '''the training loop of the experiment scripts for K replicas updated in one batched step; train_ds yields
+    (K, batch, ...) batches (one for every replica) or the batches shared by all of them, val_ds the shared ones;
+    the replica k writes its summaries, CSV (a line for every loss) and checkpoints to <out_name>_<k + 1>'''
+    train_step_fn = make_replica_train_step(ensemble, optimizer, loss_fn, shared, args.compile)
+    val_step_fn = make_replica_eval_step(ensemble, loss_fn, args.compile)
+    handlers = [ExperimentHandler(args.working_path, "%s_%d" % (args.out_name, k + 1), args.log_interval, m,
+                                  optimizer, args.keep_last, csv_name=members[0].name, patience=args.patience,
+                                  min_delta=args.min_delta)
+                for k, m in enumerate(members)]
+
+    if args.resume:
+        tqdm.write("--resume is not supported with --replicas, the training starts from scratch")
+    # the CSVs of an earlier attempt would be appended to, the runs start over
+    for h in handlers:
+        h.reset()
+    train_step, val_step = 0, 0
+    for epoch in range(args.num_epochs):
+        start = time()
+        train, steps, train_step = _run_epoch(train_step_fn, train_ds, "Train", handlers, "log_training",
+                                              train_step, args.log_interval)
+        steps_per_sec = steps / (time() - start)
+        tqdm.write("Train epoch %d | %.2f steps/sec x %d replicas" % (epoch, steps_per_sec, ensemble.k))
+
+        for k, h in enumerate(handlers):
+            h.log_training()
+            with tfc.summary.always_record_summaries():
+                tfc.summary.scalar('epoch/accuracy', train[0, k], step=epoch)
+                tfc.summary.scalar('epoch/steps_per_sec', steps_per_sec, step=epoch)
+            for l in train[:, k]:
+                h.write_csv("TRAIN, %d, %.6f\n" % (epoch, l))
+
+        val, _, val_step = _run_epoch(val_step_fn, val_ds, "Val", handlers, "log_validation", val_step,
+                                      args.log_interval)
+        for k, h in enumerate(handlers):
+            h.log_validation()
+            with tfc.summary.always_record_summaries():
+                tfc.summary.scalar('epoch/accuracy', val[0, k], step=epoch)
+            for l in val[:, k]:
+                h.write_csv("VAL, %d, %.6f\n" % (epoch, l))
+
+        ensemble.unstack_to(members)
+        # the replicas are updated together, so the training stops when all of them should stop
+        stop = all([h.update_best(val[0, k], epoch) for k, h in enumerate(handlers)])
+        last = save_last and args.checkpoint_interval and (stop or (epoch + 1) % args.checkpoint_interval == 0 or
+                                                           epoch == args.num_epochs - 1)
+        for h in handlers:
+            # the optimizer slots belong to the stacked weights and the replicas are not resumed, so only the
+            # weights of every replica are saved
+            if last:
+                h.save_weights("last_n", epoch)
+            h.flush()
+        if stop:
+            for h in handlers:
+                h.mark_stopped(epoch)
+            tqdm.write("Early stopping at epoch %d" % epoch)
+            break
+
+    for h in handlers:
+        h.close()
@@ -0,0 +1,221 @@
+import csv
+import os
+import re
+from argparse import ArgumentParser
+
+import numpy as np
+
+STORE_NAME = "results.npz"
+SPLITS = ["TRAIN", "VAL"]
+# the k-th line of a split in an epoch of the run CSV, the poly_groups script writes the MAPE after the loss
+METRICS = ["loss", "mape"]
+RUN_FIELDS = ["run", "model", "group", "n", "seed"]
+_SEED = re.compile(r"(.*)_(\d+)$")
+
+
+def parse_csv(path):
+    '''(split, epoch, metric, value) columns of a run CSV'''
+    split, epoch, metric, value = [], [], [], []
+    counts = {}
+    with open(path, 'r') as fh:
+        for line in fh:
+            parts = line.split(",")
+            if len(parts) != 3:
+                continue
+            key = SPLITS.index(parts[0].strip()), int(parts[1])
+            k = counts.get(key, 0)
+            counts[key] = k + 1
+            split.append(key[0])
+            epoch.append(key[1])
+            metric.append(k)
+            value.append(float(parts[2]))
+    return (np.array(split, np.int8), np.array(epoch, np.int32), np.array(metric, np.int8),
+            np.array(value, np.float32))
+
+
+def run_csvs(working_path):
+    '''run name (relative to working_path) -> CSV, for the run directories written by ExperimentHandler'''
+    runs = {}
+    for root, dirs, files in os.walk(working_path):
+        if "checkpoints" not in dirs:
+            continue
+        names = sorted(f for f in files if f.endswith(".csv"))
+        if names:
+            runs[os.path.relpath(root, working_path).replace(os.sep, "/")] = os.path.join(root, names[0])
+    return runs
+
+
+def _sweep_params(working_path):
+    '''out_name -> grid parameters of the runs launched by experiments/sweep.py'''
+    path = os.path.join(working_path, "sweep_index.csv")
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r', newline='') as fh:
+        return {row["out_name"]: row for row in csv.DictReader(fh)}
+
+
+def _run_fields(run, params):
+    '''model, group, n and seed of a run, from the sweep index or from the <name>_<seed> directory name'''
+    match = _SEED.fullmatch(run)
+    name, seed = (match.group(1), int(match.group(2))) if match else (run, -1)
+    p = params.get(run, {})
+    return [run, p.get("model") or name, p.get("group") or "", int(p.get("n") or -1),
+            int(p.get("seed") or seed)]
+
+
+def _metric(metric):
+    return METRICS.index(metric) if isinstance(metric, str) else metric
+
+
+class ResultsStore:
+    '''the metrics of all the run CSVs under a working directory in a single columnar file (<working_path>/results.npz):
+    the runs table (run, model, group, n, seed with the CSV signature) and the (run, split, epoch, metric, value)
+    rows; ingest parses only the new and changed CSVs'''
+
+    def __init__(self, working_path, path=None) -> None:
+        super().__init__()
+        self.working_path = working_path
+        self.path = path or os.path.join(working_path, STORE_NAME)
+        self.runs = {f: np.zeros(0, np.int64 if f in ["n", "seed"] else str) for f in RUN_FIELDS}
+        self.signatures = np.zeros((0, 2), np.int64)
+        self.rows = {"run": np.zeros(0, np.int32), "split": np.zeros(0, np.int8), "epoch": np.zeros(0, np.int32),
+                     "metric": np.zeros(0, np.int8), "value": np.zeros(0, np.float32)}
+        if os.path.exists(self.path):
+            with np.load(self.path, allow_pickle=False) as data:
+                self.runs = {f: data["runs_" + f] for f in RUN_FIELDS}
+                self.signatures = data["signatures"]
+                self.rows = {c: data[c] for c in self.rows}
+
+    def __len__(self):
+        return len(self.runs["run"])
+
+    def ingest(self):
+        '''adds the new runs, re-reads the changed ones and drops the ones which were removed, returns the number of
+        the parsed CSVs'''
+        csvs = run_csvs(self.working_path)
+        index = {r: i for i, r in enumerate(self.runs["run"])}
+        keep = np.array([r in csvs for r in self.runs["run"]], dtype=bool)
+        parsed = []
+        for run, path in sorted(csvs.items()):
+            st = os.stat(path)
+            signature = [st.st_size, st.st_mtime_ns]
+            if run in index and list(self.signatures[index[run]]) == signature:
+                continue
+            if run in index:
+                keep[index[run]] = False
+            parsed.append((run, signature, parse_csv(path)))
+        if not parsed and np.all(keep):
+            return 0
+
+        # the kept runs are renumbered, the parsed ones are appended
+        ids = np.cumsum(keep) - 1
+        rows = {c: v[keep[self.rows["run"]]] for c, v in self.rows.items()}
+        rows["run"] = ids[rows["run"]].astype(np.int32)
+        runs = [[v for v in self.runs[f][keep]] for f in RUN_FIELDS]
+        signatures = [self.signatures[keep]]
+        params = _sweep_params(self.working_path)
+        new = {c: [rows[c]] for c in rows}
+        for k, (run, signature, (split, epoch, metric, value)) in enumerate(parsed):
+            for values, v in zip(runs, _run_fields(run, params)):
+                values.append(v)
+            signatures.append(np.array([signature], np.int64))
+            new["run"].append(np.full(len(value), np.sum(keep) + k, np.int32))
+            new["split"].append(split)
+            new["epoch"].append(epoch)
+            new["metric"].append(metric)
+            new["value"].append(value)
+
+        self.runs = {f: np.array(v, dtype=self.runs[f].dtype if f in ["n", "seed"] else str)
+                     for f, v in zip(RUN_FIELDS, runs)}
+        self.signatures = np.concatenate(signatures, 0)
+        self.rows = {c: np.concatenate(v, 0) for c, v in new.items()}
+        self.save()
+        return len(parsed)
+
+    def save(self):
+        tmp = self.path + ".%d.tmp.npz" % os.getpid()
+        np.savez(tmp, signatures=self.signatures, **{"runs_" + f: v for f, v in self.runs.items()}, **self.rows)
+        os.replace(tmp, self.path)
+
+    def select_runs(self, **filters):
+        '''ids of the runs whose fields (model, group, n, seed, run) match the filters, a filter is a value or
+        a list of values'''
+        mask = np.ones(len(self), dtype=bool)
+        for f, v in filters.items():
+            mask &= np.isin(self.runs[f], v if isinstance(v, (list, tuple)) else [v])
+        return np.nonzero(mask)[0]
+
+    def _rows(self, runs, split, metric):
+        mask = np.isin(self.rows["run"], runs) & (self.rows["split"] == SPLITS.index(split)) & \
+               (self.rows["metric"] == _metric(metric))
+        return self.rows["run"][mask], self.rows["epoch"][mask], self.rows["value"][mask]
+
+    def curves(self, split="VAL", metric="loss", **filters):
+        '''(seeds, (runs, epochs) values) of the matching runs ordered by the seed, truncated to the shortest run'''
+        runs = self.select_runs(**filters)
+        runs = runs[np.argsort(self.runs["seed"][runs], kind="stable")]
+        position = np.zeros(len(self), np.int64)
+        position[runs] = np.arange(len(runs))
+        run, epoch, value = self._rows(runs, split, metric)
+        order = np.lexsort((epoch, position[run]))
+        value = value[order]
+        lengths = np.bincount(position[run], minlength=len(runs))
+        length = int(np.min(lengths)) if len(runs) else 0
+        starts = np.cumsum(lengths) - lengths
+        values = value[starts[:, np.newaxis] + np.arange(length)[np.newaxis]]
+        return self.runs["seed"][runs], values
+
+    def final(self, split="VAL", metric="loss", reduce="last", **filters):
+        '''(run ids, value of every run) at its last epoch or the best (min) one'''
+        runs = self.select_runs(**filters)
+        run, epoch, value = self._rows(runs, split, metric)
+        if reduce == "last":
+            order = np.lexsort((epoch, run))
+            run, value = run[order], value[order]
+            ends = np.concatenate([np.nonzero(np.diff(run))[0], [len(run) - 1]]) if len(run) else np.zeros(0, int)
+            return run[ends], value[ends]
+        order = np.lexsort((value, run))
+        run, value = run[order], value[order]
+        starts = np.concatenate([[0], np.nonzero(np.diff(run))[0] + 1]) if len(run) else np.zeros(0, int)
+        return run[starts], value[starts]
+
+    def summary(self, by=("model", "group"), split="VAL", metric="loss", reduce="last", **filters):
+        '''mean and std over the seeds of the final values (see final) grouped by the run fields'''
+        runs, values = self.final(split, metric, reduce, **filters)
+        keys = np.stack([self.runs[f][runs].astype(str) for f in by], axis=1) if len(runs) else \
+            np.zeros((0, len(by)), str)
+        groups, inverse = np.unique(keys, axis=0, return_inverse=True)
+        inverse = inverse.reshape(-1)
+        count = np.bincount(inverse, minlength=len(groups))
+        mean = np.bincount(inverse, values, minlength=len(groups)) / np.maximum(count, 1)
+        var = np.bincount(inverse, (values - mean[inverse]) ** 2, minlength=len(groups)) / np.maximum(count, 1)
+        return [dict(zip(by, [str(v) for v in g]), seeds=int(c), mean=float(m), std=float(s))
+                for g, c, m, s in zip(groups, count, mean, np.sqrt(var))]
+
+
+def read_results(path):
+    '''rows of a results TSV written by utils.evaluation.write_results: name, split, mean, std (of the metric over
+    the seeds), time_mean, time_std'''
+    data = np.genfromtxt(path, delimiter="\t", dtype=None, encoding=None,
+                         names=["name", "split", "mean", "std", "time_mean", "time_std"])
+    return np.atleast_1d(data)
+
+
+def pm(mean, std, scale=1., precision=1):
+    '''LaTeX mean $\\pm$ std'''
+    return "%.*f $\\pm$ %.*f" % (precision, mean * scale, precision, std * scale)
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('--working-path', type=str, default="./experiments/working_dir")
+    parser.add_argument('--split', type=str, default="VAL", choices=SPLITS)
+    parser.add_argument('--metric', type=str, default="loss", choices=METRICS)
+    parser.add_argument('--reduce', type=str, default="last", choices=["last", "min"])
+    parser.add_argument('--by', type=str, nargs='*', default=["model", "group"])
+    args = parser.parse_args()
+    store = ResultsStore(args.working_path)
+    parsed = store.ingest()
+    print("%d runs, %d parsed" % (len(store), parsed))
+    for r in store.summary(args.by, args.split, args.metric, args.reduce):
+        print("%s | %d seeds | %.6f +- %.6f" % (" ".join(r[f] for f in args.by), r["seeds"], r["mean"], r["std"]))